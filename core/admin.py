@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import Task, UserTask, User, Status, BranchesTask
+from .models import Task, UserTask, User, Status, BranchesTask, BranchOutbox, WorkLog, GitHubWebhookEvent
 
 class CustomUserAdmin(UserAdmin):
     list_display = ('id',) + UserAdmin.list_display
@@ -10,5 +10,8 @@ admin.site.register(Task)
 admin.site.register(UserTask)
 admin.site.register(Status)
 admin.site.register(BranchesTask)   
+admin.site.register(BranchOutbox)
+admin.site.register(WorkLog)
+admin.site.register(GitHubWebhookEvent)
 
 admin.site.register(User, CustomUserAdmin)
@@ -0,0 +1,180 @@
+"""
+Async counterpart of GitHubService for the async views. Talks to the GitHub REST API
+through one pooled httpx.AsyncClient per event loop, so a single ASGI worker can keep
+up to GITHUB_ASYNC_MAX_IN_FLIGHT GitHub calls in flight, paced by the shared github_scheduler.
+"""
+import asyncio
+import weakref
+from urllib.parse import quote
+import httpx
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+from .metrics import instrumented
+from .services import BranchAlreadyExists, source_shas
+from .github_scheduler import github_scheduler
+
+
+class AsyncGitHubService:
+    def __init__(self):
+        if not settings.GITHUB_ACCESS_TOKEN or not settings.GITHUB_REPO_NAME:
+            raise ValidationError(f"GitHub configuration is missing in settings")
+
+        self.repo_path = f"/repos/{settings.GITHUB_REPO_NAME}"
+        self.client = httpx.AsyncClient(
+            base_url=settings.GITHUB_API_URL,
+            headers={
+                "Authorization": f"Bearer {settings.GITHUB_ACCESS_TOKEN}",
+                "Accept": "application/vnd.github+json",
+                "X-GitHub-Api-Version": "2022-11-28",
+            },
+            limits=httpx.Limits(
+                max_connections=settings.GITHUB_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.GITHUB_ASYNC_MAX_CONNECTIONS,
+            ),
+            # Calls over the connection limit wait for a free connection instead of failing
+            timeout=httpx.Timeout(settings.GITHUB_ASYNC_TIMEOUT, pool=None),
+        )
+        self.slots = asyncio.Semaphore(settings.GITHUB_ASYNC_MAX_IN_FLIGHT)
+
+    async def _request(self, method, path, **kwargs):
+        try:
+            return await github_scheduler.asend(
+                lambda: self.client.request(method, f"{self.repo_path}{path}", **kwargs), self.slots
+            )
+        except httpx.HTTPError as e:
+            raise ValidationError(f"GitHub request failed: {e}")
+
+    @staticmethod
+    def _message(response):
+        try:
+            return response.json().get("message", response.text)
+        except ValueError:
+            return response.text
+
+    def branch_url(self, branch_name):
+        return f"https://github.com/{settings.GITHUB_REPO_NAME}/tree/{branch_name}"
+
+    # Only cache misses reach GitHub, so only they are timed as calls
+    @instrumented("get_source_sha")
+    async def _branch_sha(self, branch_name):
+        response = await self._request("GET", f"/branches/{quote(branch_name, safe='/')}")
+        if response.status_code != 200:
+            raise ValidationError(f"GitHub error: {self._message(response)}")
+        return response.json()["commit"]["sha"]
+
+    async def get_source_sha(self, source_branch="main"):
+        return await source_shas.aget(self._branch_sha, source_branch)
+
+    async def _create_ref(self, branch_name, sha):
+        return await self._request("POST", "/git/refs", json={"ref": f"refs/heads/{branch_name}", "sha": sha})
+
+    @instrumented("create_branch")
+    async def create_branch(self, branch_name, source_branch="main", source_sha=None):
+        """
+        Creates a branch in GitHub, from source_sha when the caller already knows it.
+        Returns the branch url and the SHA it points to.
+        """
+        sha = source_sha or await self.get_source_sha(source_branch)
+        response = await self._create_ref(branch_name, sha)
+        message = self._message(response) if response.status_code != 201 else ""
+        if response.status_code == 422 and (
+            "object does not exist" in message.lower() or "reference does not exist" in message.lower()
+        ):
+            await source_shas.ainvalidate(source_branch)
+            sha = await self.get_source_sha(source_branch)
+            response = await self._create_ref(branch_name, sha)
+            message = self._message(response) if response.status_code != 201 else ""
+        if response.status_code == 201:
+            return self.branch_url(branch_name), sha
+        if response.status_code == 422 and "already exists" in message.lower():
+            raise BranchAlreadyExists(f"Branch already exists in GitHub: {branch_name}")
+        raise ValidationError(f"GitHub error: {message}")
+
+    async def _ref_sha(self, branch_name):
+        """Head SHA of the branch, None when it does not exist"""
+        response = await self._request("GET", f"/git/ref/heads/{quote(branch_name, safe='/')}")
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise ValidationError(f"GitHub error: {self._message(response)}")
+        return response.json()["object"]["sha"]
+
+    @instrumented("rename_branch")
+    async def rename_branch(self, old_name, new_name, sha=None, resume=False):
+        """Async GitHubService.rename_branch()"""
+        if settings.GITHUB_NATIVE_RENAME:
+            response = await self._request(
+                "POST", f"/branches/{quote(old_name, safe='/')}/rename", json={"new_name": new_name}
+            )
+            if response.status_code == 201:
+                return self.branch_url(new_name)
+            if response.status_code not in (404, 501):
+                if response.status_code == 422:
+                    raise ValidationError(
+                        f"Failed to rename branch '{old_name}' to '{new_name}': {self._message(response)}"
+                    )
+                raise ValidationError(f"GitHub error: {self._message(response)}")
+        return await self._rename_by_copy(old_name, new_name, sha, resume)
+
+    async def _rename_by_copy(self, old_name, new_name, sha, resume):
+        old_sha = await self._ref_sha(old_name)
+        if old_sha is None and not sha:
+            raise ValidationError(f"Failed to create a new branch '{new_name}' (Old branch {old_name} missing)")
+        head = old_sha or sha
+        response = await self._create_ref(new_name, head)
+        if response.status_code != 201:
+            message = self._message(response)
+            if response.status_code != 422 or "already exists" not in message.lower():
+                raise ValidationError(f"Failed to create a new branch '{new_name}': {message}")
+            # Only a copy made by this row's own interrupted rename may be taken over
+            if not resume or await self._ref_sha(new_name) != head:
+                raise ValidationError(f"New branch already exists in GitHub: {new_name}")
+        if old_sha is not None:
+            await self.delete_branch(old_name)
+        return self.branch_url(new_name)
+
+    @instrumented("delete_branch")
+    async def delete_branch(self, branch_name):
+        response = await self._request("DELETE", f"/git/refs/heads/{quote(branch_name, safe='/')}")
+        if response.status_code not in (204, 404):
+            raise ValidationError(f"GitGub deletion error: {self._message(response)}")
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+# httpx connections belong to the event loop that opened them
+_services = weakref.WeakKeyDictionary()
+
+
+def get_async_github_service():
+    """Returns the AsyncGitHubService shared by the running event loop"""
+    loop = asyncio.get_running_loop()
+    service = _services.get(loop)
+    if service is None:
+        service = _services[loop] = AsyncGitHubService()
+    return service
+
+
+async def close_async_github_service():
+    """Closes the running event loop's client, e.g. when a load test or worker shuts down"""
+    service = _services.pop(asyncio.get_running_loop(), None)
+    if service is not None:
+        await service.aclose()
+
+
+async def gather_bounded(func, items, limit=None):
+    """
+    Awaits func(item) for every item with at most limit in flight.
+    Returns (item, result, error) tuples in the order of items, like run_concurrently().
+    """
+    semaphore = asyncio.Semaphore(limit or settings.GITHUB_ASYNC_MAX_CONNECTIONS)
+
+    async def call(item):
+        async with semaphore:
+            try:
+                return item, await func(item), None
+            except Exception as e:
+                return item, None, e
+
+    return list(await asyncio.gather(*(call(item) for item in items)))
@@ -0,0 +1,113 @@
+"""
+Opt-in stateless JWT authentication (JWT_STATELESS_AUTH=True). The request user is
+built from token claims, full User rows come from a short-lived per-process cache.
+Access tokens are checked against that cache: after a password change or deactivation
+in another worker they keep working for up to JWT_USER_CACHE_TTL seconds. Refresh
+tokens are checked against the database.
+"""
+import time
+from collections import OrderedDict
+from threading import Lock
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+class UserCache:
+    """
+    Full User rows by id, kept for JWT_USER_CACHE_TTL seconds and at most
+    JWT_USER_CACHE_SIZE of them. Entries are dropped when the user is saved in this process.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._users = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """The User with user_id, None if there is no such user"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry and now - entry[1] < settings.JWT_USER_CACHE_TTL:
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        user = get_user_model().objects.filter(pk=user_id).first()
+        if user is not None:
+            with self._lock:
+                self._users[user_id] = (user, now)
+                self._users.move_to_end(user_id)
+                while len(self._users) > settings.JWT_USER_CACHE_SIZE:
+                    self._users.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+
+user_cache = UserCache()
+
+
+def get_full_user(user):
+    """User model instance for request.user, loaded from the user cache for token users"""
+    if isinstance(user, TrackerTokenUser):
+        return user.full_user
+    return user
+
+
+def add_user_claims(token, user):
+    token["username"] = user.get_username()
+    return token
+
+
+class TrackerTokenUser(TokenUser):
+    """
+    Token-backed user with an integer id, so it compares with the user_id of model rows.
+    Staff flags come from the cached User rather than from claims that may be hours old.
+    """
+
+    @cached_property
+    def id(self):
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def full_user(self):
+        return user_cache.get(self.id)
+
+    @cached_property
+    def is_staff(self):
+        return bool(self.full_user and self.full_user.is_staff)
+
+    @cached_property
+    def is_superuser(self):
+        return bool(self.full_user and self.full_user.is_superuser)
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    Authenticates without a per-request User query. Inactive users and tokens
+    issued before a password change are rejected using the cached User row,
+    so other workers notice the change within JWT_USER_CACHE_TTL seconds.
+    """
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        full_user = user.full_user
+        if full_user is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not full_user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(
+            api_settings.REVOKE_TOKEN_CLAIM
+        ) != get_md5_hash_password(full_user.password):
+            raise AuthenticationFailed("The user's password has been changed.", code="password_changed")
+        return user
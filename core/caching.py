@@ -0,0 +1,67 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def task_version_key(task_id):
+    return f"task:{task_id}:version"
+
+
+def get_task_version(task_id):
+    """Current representation version of the task, started lazily on first read"""
+    key = task_version_key(task_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=settings.TASK_VERSION_TTL)
+        version = cache.get(key)
+    return version
+
+
+def bump_task_versions(*task_ids):
+    """
+    Invalidates cached representations of the tasks once the current transaction commits,
+    so readers cannot cache rows that are about to change under the new version.
+    """
+    task_ids = {task_id for task_id in task_ids if task_id is not None}
+    if not task_ids or not settings.TASK_CACHE_ENABLED:
+        return
+
+    def bump():
+        version = time.time_ns()
+        cache.set_many({task_version_key(task_id): version for task_id in task_ids}, timeout=settings.TASK_VERSION_TTL)
+
+    transaction.on_commit(bump)
+
+
+def cached_task_response(request, task_id, render, *args, **kwargs):
+    """
+    Answers a read of task data with an ETag bound to the task version.
+    A matching If-None-Match gets 304 before anything is serialized, otherwise
+    the payload is served from the cache under a versioned key or rendered once.
+    Payloads are kept per user, since they carry the caller's role.
+    Without a shared cache (TASK_CACHE_ENABLED) every request is rendered, as workers
+    would otherwise answer from versions the others never bumped.
+    """
+    if not settings.TASK_CACHE_ENABLED:
+        return render(request, *args, **kwargs)
+    version = get_task_version(task_id)
+    digest = hashlib.md5(f"{request.user.id}:{request.get_full_path()}".encode()).hexdigest()[:16]
+    etag = f'"{task_id}-{version}-{digest}"'
+
+    if_none_match = request.headers.get("If-None-Match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    key = f"task:{task_id}:{version}:{digest}"
+    data = cache.get(key)
+    if data is None:
+        response = render(request, *args, **kwargs)
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        data = response.data
+        cache.set(key, data, settings.TASK_CACHE_TTL)
+    return Response(data, headers={"ETag": etag})
@@ -0,0 +1,67 @@
+import csv
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from .models import Task
+
+EXPORT_COLUMNS = {
+    "task_id": "id",
+    "task_name": "name",
+    "task_slug": "slug",
+    "task_type": "type",
+    "status": "status__name",
+    "planned_time": "planned_time",
+    "user_id": "usertask__user_id",
+    "username": "usertask__user__username",
+    "role": "usertask__role",
+    "work_time": "usertask__work_time",
+}
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def export_rows(chunk_size):
+    """
+    One row per task participant (tasks without participants once), read through
+    a server-side cursor so memory stays flat regardless of the table size.
+    """
+    return (
+        Task.objects
+        .order_by("id", "usertask__id")
+        .values_list(*EXPORT_COLUMNS.values())
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+class Echo:
+    """File-like object for csv.writer that hands the written line back"""
+
+    def write(self, value):
+        return value
+
+
+def _batched(lines, size):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+
+def stream_export(export_format, chunk_size):
+    rows = export_rows(chunk_size)
+    if export_format == "csv":
+        writer = csv.writer(Echo())
+        lines = (writer.writerow(row) for row in rows)
+        yield writer.writerow(EXPORT_COLUMNS.keys())
+    else:
+        lines = (
+            json.dumps(dict(zip(EXPORT_COLUMNS, row)), cls=DjangoJSONEncoder) + "\n"
+            for row in rows
+        )
+    yield from _batched(lines, chunk_size)
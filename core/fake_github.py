@@ -0,0 +1,211 @@
+"""
+In-memory stand-in for the part of the GitHub REST API used by GitHubService.
+Point GITHUB_API_URL at it to run the outbox worker offline.
+"""
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so pooled clients reuse their connections
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.dispatch(self, "GET")
+
+    def do_POST(self):
+        self.server.dispatch(self, "POST")
+
+    def do_DELETE(self):
+        self.server.dispatch(self, "DELETE")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeGitHubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open hundreds of connections at once
+    request_queue_size = 1024
+
+    def __init__(self, repo_name, host="127.0.0.1", port=0, latency=0.0, default_branch="main", rate_limit=5000,
+                 native_rename=True):
+        super().__init__((host, port), FakeGitHubHandler)
+        self.repo_name = repo_name
+        self.latency = latency
+        self.default_branch = default_branch
+        self.lock = threading.Lock()
+        self.branches = {default_branch: self._sha(default_branch)}
+        self.calls = 0
+        self.rate_limit = rate_limit
+        # Off emulates a GitHub Enterprise server without the branch rename endpoint
+        self.native_rename = native_rename
+        self.rate_remaining = rate_limit
+        self.rate_reset = int(time.time()) + 3600
+        self.secondary_limited = 0
+        self.retry_after = 1
+        self.server_errors = 0
+        self._thread = None
+
+    def limit_secondary(self, requests, retry_after=1):
+        """Answers the next requests with a secondary rate limit error, as in bulk onboarding"""
+        with self.lock:
+            self.secondary_limited = requests
+            self.retry_after = retry_after
+
+    def fail_after_apply(self, requests):
+        """Applies the next requests but answers them with 502, as a gateway timing out"""
+        with self.lock:
+            self.server_errors = requests
+
+    def _rate_limited(self):
+        """A rate limit error for the current request, None when it is within the limits"""
+        if self.secondary_limited:
+            self.secondary_limited -= 1
+            return 403, {"message": "You have exceeded a secondary rate limit."}, {"Retry-After": str(self.retry_after)}
+        if self.rate_remaining <= 0:
+            return 403, {"message": "API rate limit exceeded."}, {}
+        self.rate_remaining -= 1
+        return None
+
+    def _rate_headers(self):
+        return {
+            "X-RateLimit-Limit": str(self.rate_limit),
+            "X-RateLimit-Remaining": str(self.rate_remaining),
+            "X-RateLimit-Used": str(self.rate_limit - self.rate_remaining),
+            "X-RateLimit-Reset": str(self.rate_reset),
+            "X-RateLimit-Resource": "core",
+        }
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def repo_url(self):
+        return f"{self.url}/repos/{self.repo_name}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _sha(self, seed):
+        return hashlib.sha1(f"{seed}-{time.monotonic_ns()}".encode()).hexdigest()
+
+    def _ref(self, name):
+        return {
+            "ref": f"refs/heads/{name}",
+            "url": f"{self.repo_url}/git/refs/heads/{quote(name)}",
+            "object": {"sha": self.branches[name], "type": "commit"},
+        }
+
+    def _branch(self, name):
+        return {
+            "name": name,
+            "commit": {"sha": self.branches[name]},
+            "protected": False,
+        }
+
+    def _repo(self):
+        owner, name = self.repo_name.split("/", 1)
+        return {
+            "id": 1,
+            "name": name,
+            "full_name": self.repo_name,
+            "owner": {"login": owner},
+            "url": self.repo_url,
+            "default_branch": self.default_branch,
+        }
+
+    def dispatch(self, request, method):
+        request.body = request.rfile.read(int(request.headers.get("Content-Length", 0)))
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls += 1
+            status, body, *headers = self._rate_limited() or self.route(request, method)
+            if self.server_errors:
+                self.server_errors -= 1
+                status, body, headers = 502, {"message": "Server Error"}, []
+            headers = {**self._rate_headers(), **(headers[0] if headers else {})}
+        payload = b"" if body is None else json.dumps(body).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(payload)
+
+    def _matching_refs(self, prefix, query):
+        """Refs under refs/{prefix} by name, paginated with a Link header when per_page is given"""
+        names = sorted(name for name in self.branches if f"heads/{name}".startswith(prefix))
+        refs = [self._ref(name) for name in names]
+        if "per_page" not in query:
+            return 200, refs
+        per_page = int(query["per_page"][0])
+        page = int(query.get("page", ["1"])[0])
+        headers = {}
+        if page * per_page < len(refs):
+            next_url = f"{self.repo_url}/git/matching-refs/{quote(prefix, safe='')}?per_page={per_page}&page={page + 1}"
+            headers["Link"] = f'<{next_url}>; rel="next"'
+        return 200, refs[(page - 1) * per_page:page * per_page], headers
+
+    def route(self, request, method):
+        url = urlsplit(request.path)
+        path = unquote(url.path)
+        prefix = f"/repos/{self.repo_name}"
+        if not path.startswith(prefix):
+            return 404, {"message": "Not Found"}
+        path = path[len(prefix):]
+
+        if path == "" and method == "GET":
+            return 200, self._repo()
+        if path.startswith("/branches/") and method == "GET":
+            name = path[len("/branches/"):]
+            if name not in self.branches:
+                return 404, {"message": "Branch not found"}
+            return 200, self._branch(name)
+        if path.startswith("/branches/") and path.endswith("/rename") and method == "POST":
+            if not self.native_rename:
+                return 404, {"message": "Not Found"}
+            name = path[len("/branches/"):-len("/rename")]
+            new_name = json.loads(request.body or b"{}").get("new_name", "")
+            if name not in self.branches:
+                return 404, {"message": "Branch not found"}
+            if new_name in self.branches:
+                return 422, {"message": "Validation Failed"}
+            self.branches[new_name] = self.branches.pop(name)
+            return 201, self._branch(new_name)
+        if path.startswith("/git/matching-refs/") and method == "GET":
+            return self._matching_refs(path[len("/git/matching-refs/"):], parse_qs(url.query))
+        if path == "/git/refs" and method == "POST":
+            data = json.loads(request.body or b"{}")
+            name = data.get("ref", "").removeprefix("refs/heads/")
+            if name in self.branches:
+                return 422, {"message": "Reference already exists"}
+            if data.get("sha") not in self.branches.values():
+                return 422, {"message": "Object does not exist"}
+            self.branches[name] = data["sha"]
+            return 201, self._ref(name)
+        for ref_prefix in ("/git/ref/heads/", "/git/refs/heads/"):
+            if path.startswith(ref_prefix):
+                name = path[len(ref_prefix):]
+                if name not in self.branches:
+                    return 404, {"message": "Not Found"}
+                if method == "GET":
+                    return 200, self._ref(name)
+                if method == "DELETE":
+                    del self.branches[name]
+                    return 204, None
+        return 404, {"message": "Not Found"}
@@ -0,0 +1,45 @@
+"""
+PyGithub connection classes safe to share between threads. PyGithub keeps one persistent
+connection per client and stores the arguments of request() on it until getresponse(),
+so threads of run_concurrently() sharing the pooled client would send each other's requests.
+"""
+from threading import local
+from github.Requester import HTTPRequestsConnectionClass, HTTPSRequestsConnectionClass, Requester, RequestsResponse
+
+
+class ThreadLocalConnectionMixin:
+    """Keeps the request arguments per thread, the pooled HTTP session stays shared"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._local = local()
+
+    def request(self, verb, url, input, headers, stream=False):
+        self._local.request = (verb, url, input, headers)
+
+    def send(self, verb, url, input, headers):
+        """Sends the request with the pooled session, returns its RequestsResponse"""
+        return RequestsResponse(getattr(self.session, verb.lower())(
+            f"{self.protocol}://{self.host}:{self.port}{url}",
+            headers=headers,
+            data=input,
+            timeout=self.timeout,
+            verify=self.verify,
+            allow_redirects=False,
+        ))
+
+    def getresponse(self):
+        return self.send(*self._local.request)
+
+
+class ThreadLocalHTTPConnection(ThreadLocalConnectionMixin, HTTPRequestsConnectionClass):
+    pass
+
+
+class ThreadLocalHTTPSConnection(ThreadLocalConnectionMixin, HTTPSRequestsConnectionClass):
+    pass
+
+
+def install():
+    """Makes PyGithub clients created from now on safe to share between threads"""
+    Requester.injectConnectionClasses(ThreadLocalHTTPConnection, ThreadLocalHTTPSConnection)
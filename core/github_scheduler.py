@@ -0,0 +1,226 @@
+"""
+Central scheduler of GitHub API requests for this process. Every request of GitHubService
+and AsyncGitHubService takes a token from a shared bucket, runs within a concurrency cap,
+and is retried with jittered backoff when GitHub answers with a rate limit.
+The quota GitHub reports in the X-RateLimit-* headers is tracked from every response.
+"""
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from threading import BoundedSemaphore, Lock
+from django.conf import settings
+from github.Requester import HTTPRequestsConnectionClass, HTTPSRequestsConnectionClass, Requester
+from rest_framework.exceptions import Throttled
+from .github_connection import ThreadLocalConnectionMixin
+
+logger = logging.getLogger(__name__)
+
+
+def is_rate_limited(status, headers, body):
+    """GitHub signals primary and secondary rate limits with 429 or with 403 and a rate limit message"""
+    if status == 429:
+        return True
+    if status != 403:
+        return False
+    return headers.get("x-ratelimit-remaining") == "0" or "retry-after" in headers or "rate limit" in body.lower()
+
+
+class GitHubScheduler:
+    """
+    Token bucket of GITHUB_RATE_LIMIT_PER_SECOND requests with bursts of GITHUB_RATE_LIMIT_BURST,
+    at most GITHUB_MAX_IN_FLIGHT sync requests at a time, async ones are capped per event loop
+    by GITHUB_ASYNC_MAX_IN_FLIGHT. Once the quota left is down to GITHUB_RATE_LIMIT_RESERVE,
+    requests wait for the reset. Waits longer than GITHUB_RATE_LIMIT_MAX_WAIT raise Throttled
+    instead of blocking the caller.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._tokens = None
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._slots = None
+        self.in_flight = 0
+        self.limit = None
+        self.remaining = None
+        self.used = None
+        self.reset_at = None
+        self.resource = None
+        self.requests = 0
+        self.retries = 0
+        self.delayed = 0
+        self.delay_seconds = 0.0
+        self.rejected = 0
+
+    def reserve(self):
+        """Takes a token, returns the seconds to wait before sending the request"""
+        with self._lock:
+            now = time.monotonic()
+            rate = settings.GITHUB_RATE_LIMIT_PER_SECOND
+            burst = settings.GITHUB_RATE_LIMIT_BURST
+            tokens = burst if self._tokens is None else min(burst, self._tokens + (now - self._refilled_at) * rate)
+            wait = max(0.0, (1 - tokens) / rate, self._paused_until - now)
+            if self.remaining is not None and self.remaining <= settings.GITHUB_RATE_LIMIT_RESERVE and self.reset_at:
+                wait = max(wait, self.reset_at - time.time())
+            if wait > settings.GITHUB_RATE_LIMIT_MAX_WAIT:
+                self.rejected += 1
+                raise Throttled(wait=wait, detail="GitHub rate limit budget is exhausted")
+            self._tokens = tokens - 1
+            self._refilled_at = now
+            self.requests += 1
+            if self.remaining:
+                self.remaining -= 1
+            if wait:
+                self.delayed += 1
+                self.delay_seconds += wait
+            return wait
+
+    def update(self, headers):
+        """Takes the quota from X-RateLimit-* headers, responses of the same window only lower it"""
+        if "x-ratelimit-remaining" not in headers:
+            return
+        try:
+            remaining = int(headers["x-ratelimit-remaining"])
+            reset_at = int(headers.get("x-ratelimit-reset", 0)) or None
+            limit = int(headers.get("x-ratelimit-limit", 0)) or None
+            used = int(headers.get("x-ratelimit-used", 0))
+        except ValueError:
+            return
+        with self._lock:
+            if reset_at == self.reset_at and self.remaining is not None:
+                remaining = min(remaining, self.remaining)
+            self.remaining = remaining
+            self.reset_at = reset_at
+            self.limit = limit
+            self.used = used
+            self.resource = headers.get("x-ratelimit-resource", self.resource)
+
+    def backoff(self, attempt, headers):
+        """
+        Seconds to wait before retrying a rate limited request: Retry-After, the quota reset
+        or exponential backoff, with jitter on top. All requests pause for that long.
+        """
+        if "retry-after" in headers:
+            delay = float(headers["retry-after"])
+        elif headers.get("x-ratelimit-remaining") == "0" and headers.get("x-ratelimit-reset"):
+            delay = float(headers["x-ratelimit-reset"]) - time.time()
+        else:
+            delay = settings.GITHUB_RATE_LIMIT_BACKOFF * 2 ** attempt
+        delay = max(delay, 0.0) * random.uniform(1.0, 1.5)
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self.retries += 1
+        return delay
+
+    def _retry_delay(self, attempt, status, headers, body):
+        """Backoff before the next attempt, None when the response is final"""
+        self.update(headers)
+        if attempt >= settings.GITHUB_RATE_LIMIT_RETRIES or not is_rate_limited(status, headers, body):
+            return None
+        delay = self.backoff(attempt, headers)
+        if delay > settings.GITHUB_RATE_LIMIT_MAX_WAIT:
+            return None
+        logger.warning("GitHub rate limited the request (%s), retrying in %.1fs", status, delay)
+        return delay
+
+    def _acquire_slot(self):
+        with self._lock:
+            if self._slots is None:
+                self._slots = BoundedSemaphore(settings.GITHUB_MAX_IN_FLIGHT)
+        self._slots.acquire()
+        with self._lock:
+            self.in_flight += 1
+
+    def _release_slot(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def send(self, send_request):
+        """Sends a request of PyGithub, send_request() returns its RequestsResponse"""
+        attempt = 0
+        while True:
+            wait = self.reserve()
+            if wait:
+                time.sleep(wait)
+            self._acquire_slot()
+            try:
+                response = send_request()
+            finally:
+                self._release_slot()
+            delay = self._retry_delay(attempt, response.status, response.headers, response.read())
+            if delay is None:
+                return response
+            time.sleep(delay)
+            attempt += 1
+
+    async def asend(self, send_request, slots):
+        """Async send() for httpx, slots is the event loop's semaphore capping requests in flight"""
+        attempt = 0
+        while True:
+            wait = self.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            async with slots:
+                with self._lock:
+                    self.in_flight += 1
+                try:
+                    response = await send_request()
+                finally:
+                    with self._lock:
+                        self.in_flight -= 1
+            delay = self._retry_delay(attempt, response.status_code, response.headers, response.text)
+            if delay is None:
+                return response
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            tokens = settings.GITHUB_RATE_LIMIT_BURST if self._tokens is None else min(
+                settings.GITHUB_RATE_LIMIT_BURST,
+                self._tokens + (now - self._refilled_at) * settings.GITHUB_RATE_LIMIT_PER_SECOND,
+            )
+            return {
+                "limit": self.limit,
+                "remaining": self.remaining,
+                "used": self.used,
+                "resource": self.resource,
+                "reset_at": datetime.fromtimestamp(self.reset_at, timezone.utc).isoformat() if self.reset_at else None,
+                "reset_timestamp": self.reset_at,
+                "bucket_tokens": round(tokens, 2),
+                "paused_for": round(max(0.0, self._paused_until - now), 2),
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "retries": self.retries,
+                "delayed": self.delayed,
+                "delay_seconds": round(self.delay_seconds, 3),
+                "rejected": self.rejected,
+            }
+
+
+github_scheduler = GitHubScheduler()
+
+
+class ScheduledConnectionMixin(ThreadLocalConnectionMixin):
+    """PyGithub connection sending every request through github_scheduler"""
+
+    def getresponse(self):
+        verb, url, input, headers = self._local.request
+        return github_scheduler.send(lambda: self.send(verb, url, input, headers))
+
+
+class ScheduledHTTPConnection(ScheduledConnectionMixin, HTTPRequestsConnectionClass):
+    pass
+
+
+class ScheduledHTTPSConnection(ScheduledConnectionMixin, HTTPSRequestsConnectionClass):
+    pass
+
+
+def install():
+    """Routes the requests of PyGithub clients created from now on through the scheduler"""
+    Requester.injectConnectionClasses(ScheduledHTTPConnection, ScheduledHTTPSConnection)
@@ -0,0 +1,341 @@
+import asyncio
+import gc
+import json
+import statistics
+import time
+from itertools import cycle
+from threading import Lock, Thread
+from asgiref.sync import ThreadSensitiveContext
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment
+from django.urls import include, path
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from core.async_github import close_async_github_service
+from core.authentication import add_user_claims
+from core.fake_github import FakeGitHubServer
+from core.models import BranchesTask, Status, Task, User, UserTask
+from core.services import github_services
+from core.urls import build_urlpatterns
+from core.utils import create_branch_name
+
+BENCHMARK_REPO = "benchmark/task-tracker"
+
+SCENARIOS = (
+    "task_create", "task_list", "task_retrieve", "log_time", "participant_add", "branch_rename", "branch_create_load"
+)
+
+
+class BenchmarkUrls:
+    """URLconf serving the API with either the sync or the async GitHub-bound viewsets"""
+
+    def __init__(self, async_github_views):
+        self.urlpatterns = [path("api/", include(build_urlpatterns(async_github_views)))]
+
+
+def summarize(durations, elapsed, errors, **extra):
+    percentiles = statistics.quantiles(durations, n=100, method="inclusive") if len(durations) > 1 else durations * 99
+    return {
+        "requests": len(durations),
+        "errors": errors,
+        "req_per_sec": round(len(durations) / elapsed, 2),
+        "mean_ms": round(statistics.fmean(durations), 2),
+        "p50_ms": round(percentiles[49], 2),
+        "p95_ms": round(percentiles[94], 2),
+        "p99_ms": round(percentiles[98], 2),
+        **extra,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the core endpoints in a throwaway test database against the fake GitHub server "
+        "and writes req/s, latency percentiles and SQL query counts as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--tasks", type=int, default=500)
+        parser.add_argument("--participants", type=int, default=3, help="Participants per task, owner included")
+        parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+        parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every fake GitHub response")
+        parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="Run only the given scenarios")
+        parser.add_argument("--output", default="benchmark.json")
+        parser.add_argument("--keepdb", action="store_true", help="Reuse the test database between runs")
+        parser.add_argument(
+            "--no-native-rename", action="store_true", help="Fake GitHub without the branch rename endpoint"
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=100, help="Requests in flight for the async views in branch_create_load"
+        )
+        parser.add_argument(
+            "--sync-threads", type=int, default=8, help="Worker threads serving the sync views in branch_create_load"
+        )
+
+    def seed(self, users_count, tasks_count, participants, server):
+        password = make_password(None)
+        users = User.objects.bulk_create([
+            User(username=f"bench-user-{i}", password=password) for i in range(users_count)
+        ])
+        status = Status.objects.create(name="benchmark")
+        tasks = Task.objects.bulk_create([
+            Task(name=f"Benchmark task {i}", type=Task.TaskType.FEATURE, status=status, planned_time=8)
+            for i in range(tasks_count)
+        ])
+        for task in tasks:
+            task.slug = task.build_slug()
+        Task.objects.bulk_update(tasks, ["slug"], batch_size=1000)
+
+        owner, others = users[0], users[1:]
+        user_tasks = UserTask.objects.bulk_create([
+            UserTask(
+                user=owner if offset == 0 else others[(index + offset - 1) % len(others)],
+                task=task,
+                role=UserTask.Role.OWNER if offset == 0 else UserTask.Role.EXECUTOR,
+            )
+            for index, task in enumerate(tasks)
+            for offset in range(min(participants, users_count))
+        ], batch_size=1000)
+        branches = [
+            BranchesTask(
+                user_task=user_task,
+                task=user_task.task,
+                name=create_branch_name(user_task.task, user_task),
+                state=BranchesTask.State.ACTIVE,
+            )
+            for user_task in user_tasks
+        ]
+        source_sha = server.branches[server.default_branch]
+        for branch in branches:
+            server.branches[branch.name] = source_sha
+        BranchesTask.objects.bulk_create(branches, batch_size=1000)
+
+        owned = [user_task for user_task in user_tasks if user_task.role == UserTask.Role.OWNER]
+        return owner, users, tasks, owned
+
+    def scenarios(self, owner, users, tasks, owned):
+        """Request factories, each call sends one request with the owner's client"""
+        client = APIClient()
+        client.force_authenticate(owner)
+        task_ids = cycle([task.pk for task in tasks])
+        own_logs = cycle(owned)
+        counter = iter(range(1, 10 ** 9))
+
+        def task_create():
+            return client.post("/api/tasks/", {
+                "name": f"Created by benchmark {next(counter)}",
+                "type": Task.TaskType.FEATURE,
+                "status": "benchmark",
+                "planned_time": "4.00",
+            }, format="json")
+
+        def task_list():
+            return client.get("/api/tasks/")
+
+        def task_retrieve():
+            return client.get(f"/api/tasks/{next(task_ids)}/")
+
+        def log_time():
+            user_task = next(own_logs)
+            return client.post(
+                f"/api/tasks/{user_task.task_id}/users/{user_task.pk}/log_time/",
+                {"hours": "0.25"}, format="json"
+            )
+
+        taken = set(UserTask.objects.values_list("task_id", "user_id"))
+        free_slots = iter([
+            (task.pk, user.pk)
+            for user in users[1:]
+            for task in tasks
+            if (task.pk, user.pk) not in taken
+        ])
+
+        def participant_add():
+            try:
+                task_id, user_id = next(free_slots)
+            except StopIteration:
+                raise CommandError("Every user already takes part in every task, seed more users or tasks")
+            return client.post(
+                f"/api/tasks/{task_id}/users/",
+                {"user": user_id, "role": UserTask.Role.EXECUTOR}, format="json"
+            )
+
+        def branch_rename():
+            return client.patch(
+                f"/api/tasks/{next(task_ids)}/",
+                {"name": f"Renamed by benchmark {next(counter)}"}, format="json"
+            )
+
+        return {
+            "task_create": task_create,
+            "task_list": task_list,
+            "task_retrieve": task_retrieve,
+            "log_time": log_time,
+            "participant_add": participant_add,
+            "branch_rename": branch_rename,
+        }
+
+    def measure(self, send, requests, server):
+        durations = []
+        queries = []
+        errors = 0
+        github_calls = server.calls
+        started = time.perf_counter()
+        for _ in range(requests):
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                response = send()
+                durations.append((time.perf_counter() - request_started) * 1000)
+            queries.append(len(captured))
+            if response.status_code >= 400:
+                errors += 1
+        elapsed = time.perf_counter() - started
+        return summarize(
+            durations, elapsed, errors,
+            queries_mean=round(statistics.fmean(queries), 2),
+            queries_max=max(queries),
+            github_calls=server.calls - github_calls,
+        )
+
+    def load_test(self, owner, tasks, options, server):
+        """
+        Creates branches under concurrent load, once through the sync views served by
+        --sync-threads worker threads and once through the async views of a single
+        event loop with --concurrency requests in flight.
+        """
+        token = add_user_claims(AccessToken.for_user(owner), owner)
+        headers = {"Authorization": f"Bearer {token}"}
+        requests = options["requests"]
+
+        def request_args(mode, index):
+            task = tasks[index % len(tasks)]
+            return f"/api/tasks/{task.pk}/branches/", {"name": f"load/{mode}/{index}"}
+
+        def run_sync():
+            client = Client()
+            pending = iter(range(requests))
+            lock = Lock()
+            outcomes = []
+
+            def worker():
+                try:
+                    while True:
+                        with lock:
+                            index = next(pending, None)
+                        if index is None:
+                            return
+                        url, data = request_args("sync", index)
+                        request_started = time.perf_counter()
+                        response = client.post(url, data, content_type="application/json", headers=headers)
+                        outcomes.append(((time.perf_counter() - request_started) * 1000, response.status_code))
+                finally:
+                    connections.close_all()
+
+            threads = [Thread(target=worker) for _ in range(options["sync_threads"])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return outcomes
+
+        async def run_async():
+            client = AsyncClient()
+            semaphore = asyncio.Semaphore(options["concurrency"])
+
+            async def send(index):
+                url, data = request_args("async", index)
+                # Like ASGIHandler, give every request its own thread for sync code
+                async with semaphore, ThreadSensitiveContext():
+                    request_started = time.perf_counter()
+                    response = await client.post(url, data, content_type="application/json", headers=headers)
+                    return (time.perf_counter() - request_started) * 1000, response.status_code
+
+            try:
+                return await asyncio.gather(*(send(index) for index in range(requests)))
+            finally:
+                await close_async_github_service()
+
+        results = {}
+        for mode, async_views, run in (("sync_views", False, run_sync), ("async_views", True, lambda: asyncio.run(run_async()))):
+            github_calls = server.calls
+            with override_settings(ROOT_URLCONF=BenchmarkUrls(async_views)):
+                started = time.perf_counter()
+                outcomes = run()
+                elapsed = time.perf_counter() - started
+            results[mode] = summarize(
+                [duration for duration, _ in outcomes], elapsed,
+                sum(1 for _, status_code in outcomes if status_code >= 400),
+                github_calls=server.calls - github_calls,
+            )
+        gc.collect()
+        results["async_speedup"] = round(results["async_views"]["req_per_sec"] / results["sync_views"]["req_per_sec"], 2)
+        return results
+
+    def write_result(self, name, result):
+        line = (
+            f"{name:<16} {result['req_per_sec']:>8} req/s  "
+            f"p50 {result['p50_ms']:>8} ms  p95 {result['p95_ms']:>8} ms  p99 {result['p99_ms']:>8} ms  "
+        )
+        if "queries_mean" in result:
+            line += f"queries {result['queries_mean']:>6}  "
+        self.stdout.write(line + f"github {result['github_calls']:>4}  errors {result['errors']}")
+
+    def handle(self, *args, **options):
+        server = FakeGitHubServer(
+            BENCHMARK_REPO, latency=options["latency"], rate_limit=10 ** 9,
+            native_rename=not options["no_native_rename"],
+        ).start()
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keepdb"])
+        try:
+            with override_settings(
+                GITHUB_API_URL=server.url,
+                GITHUB_REPO_NAME=BENCHMARK_REPO,
+                GITHUB_ACCESS_TOKEN="benchmark",
+                # Measure the app, not the request budget meant for the real GitHub
+                GITHUB_RATE_LIMIT_PER_SECOND=10 ** 6,
+                GITHUB_RATE_LIMIT_BURST=10 ** 6,
+                CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "benchmark"}},
+            ):
+                github_services.reset()
+                seeded = self.seed(options["users"], options["tasks"], options["participants"], server)
+                scenarios = self.scenarios(*seeded)
+                results = {}
+                for name in options["scenario"] or SCENARIOS:
+                    if name == "branch_create_load":
+                        owner, _, tasks, _ = seeded
+                        results[name] = self.load_test(owner, tasks, options, server)
+                        for mode in ("sync_views", "async_views"):
+                            self.write_result(f"{name} {mode}", results[name][mode])
+                        self.stdout.write(f"async views speedup: {results[name]['async_speedup']}x")
+                        continue
+                    results[name] = self.measure(scenarios[name], options["requests"], server)
+                    self.write_result(name, results[name])
+        finally:
+            github_services.reset()
+            if options["keepdb"]:
+                call_command("flush", verbosity=0, interactive=False)
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+            server.stop()
+
+        report = {
+            "created_at": timezone.now().isoformat(),
+            "database": connection.vendor,
+            "options": {
+                key: options[key]
+                for key in (
+                    "users", "tasks", "participants", "requests", "latency", "concurrency", "sync_threads",
+                    "no_native_rename",
+                )
+            },
+            "results": results,
+        }
+        with open(options["output"], "w") as output:
+            json.dump(report, output, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
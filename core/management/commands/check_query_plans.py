@@ -0,0 +1,77 @@
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from core.models import BranchesTask, Task, User, UserTask
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway dataset inside a rolled back transaction and fails "
+        "if the hot permission and listing queries fall back to sequential scans"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--tasks", type=int, default=5000)
+        parser.add_argument("--participants", type=int, default=4, help="Participants per task")
+
+    def hot_queries(self, user_id, task_id):
+        return {
+            "membership": UserTask.objects.filter(user_id=user_id, task_id=task_id).values_list("role"),
+            "owner check": UserTask.objects.filter(user_id=user_id, task_id=task_id, role=UserTask.Role.OWNER),
+            "task owners": UserTask.objects.filter(task_id=task_id, role=UserTask.Role.OWNER),
+            "my tasks": UserTask.objects.filter(user_id=user_id).values_list("task_id"),
+            "my task board": Task.objects.participated_by(user_id, role=UserTask.Role.OWNER).order_by("id")[:50],
+            "task participants": UserTask.objects.filter(task_id=task_id).order_by("id")[:50],
+            "task branches": BranchesTask.objects.filter(task_id=task_id).order_by("id")[:50],
+        }
+
+    def seed(self, users_count, tasks_count, participants):
+        password = make_password(None)
+        users = User.objects.bulk_create([
+            User(username=f"plan-check-user-{i}", password=password) for i in range(users_count)
+        ])
+        tasks = Task.objects.bulk_create([
+            Task(name=f"Plan check {i}", type=Task.TaskType.FEATURE, slug=f"plan-check-{i}")
+            for i in range(tasks_count)
+        ])
+        user_tasks = UserTask.objects.bulk_create([
+            UserTask(
+                user=users[(index + offset) % users_count],
+                task=task,
+                role=UserTask.Role.OWNER if offset == 0 else UserTask.Role.EXECUTOR,
+            )
+            for index, task in enumerate(tasks)
+            for offset in range(min(participants, users_count))
+        ], batch_size=5000)
+        BranchesTask.objects.bulk_create([
+            BranchesTask(name=f"plan-check/{user_task.task_id}/{user_task.user_id}", task_id=user_task.task_id, user_task=user_task)
+            for user_task in user_tasks
+        ], batch_size=5000)
+        with connection.cursor() as cursor:
+            for model in (User, Task, UserTask, BranchesTask):
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
+        return users[users_count // 2].pk, tasks[tasks_count // 2].pk
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Query plans are only checked on PostgreSQL")
+
+        regressions = []
+        with transaction.atomic():
+            user_id, task_id = self.seed(options["users"], options["tasks"], options["participants"])
+            for name, queryset in self.hot_queries(user_id, task_id).items():
+                plan = queryset.explain()
+                seq_scans = [
+                    line.strip() for line in plan.splitlines()
+                    if "Seq Scan on core_usertask" in line or "Seq Scan on core_branchestask" in line
+                ]
+                if seq_scans:
+                    regressions.append(f"{name}: {'; '.join(seq_scans)}")
+                    self.stdout.write(self.style.ERROR(f"{name}\n{plan}"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f"{name}: {plan.splitlines()[0].strip()}"))
+            transaction.set_rollback(True)
+
+        if regressions:
+            raise CommandError("Sequential scans in hot queries:\n" + "\n".join(regressions))
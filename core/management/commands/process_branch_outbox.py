@@ -0,0 +1,24 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.outbox import process_batch
+
+
+class Command(BaseCommand):
+    help = "Creates queued GitHub branches from the branch outbox, retrying failures with backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.BRANCH_OUTBOX_BATCH_SIZE)
+        parser.add_argument("--max-attempts", type=int, default=settings.BRANCH_OUTBOX_MAX_ATTEMPTS)
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds to sleep when the outbox is empty")
+        parser.add_argument("--once", action="store_true", help="Drain what is due and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            succeeded, failed = process_batch(options["batch_size"], options["max_attempts"])
+            if succeeded or failed:
+                self.stdout.write(f"Branch outbox batch: {succeeded} created, {failed} failed")
+                continue
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
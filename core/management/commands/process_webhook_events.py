@@ -0,0 +1,44 @@
+import json
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core.webhooks import process_events, purge_processed_events, store_event
+
+
+class Command(BaseCommand):
+    help = "Applies stored GitHub webhook events to BranchesTask in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=settings.GITHUB_WEBHOOK_BATCH_SIZE)
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds to sleep when no events are waiting")
+        parser.add_argument("--once", action="store_true", help="Apply what is waiting and exit")
+        parser.add_argument(
+            "--file",
+            help="Store recorded deliveries first, one JSON object per line with event, delivery and payload keys",
+        )
+
+    def load_file(self, path):
+        stored = 0
+        with open(path) as recorded:
+            for number, line in enumerate(recorded, 1):
+                if not line.strip():
+                    continue
+                try:
+                    delivery = json.loads(line)
+                    stored += store_event(delivery["delivery"], delivery["event"], delivery["payload"])
+                except (ValueError, KeyError) as e:
+                    raise CommandError(f"{path}:{number}: not a recorded delivery: {e}")
+        self.stdout.write(f"Recorded deliveries stored: {stored}")
+
+    def handle(self, *args, **options):
+        if options["file"]:
+            self.load_file(options["file"])
+        while True:
+            processed, updated = process_events(options["batch_size"])
+            if processed:
+                self.stdout.write(f"Webhook batch: {processed} events, {updated} branches updated")
+                continue
+            purge_processed_events()
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
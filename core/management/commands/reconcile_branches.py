@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from core.reconcile import reconcile_branches
+
+
+class Command(BaseCommand):
+    help = (
+        "Lists the GitHub branches once and syncs them with BranchesTask: creates missing branches, "
+        "fixes urls and deletes branches of deleted tasks. Untracked branches are only reported"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+
+    def handle(self, *args, **options):
+        result = reconcile_branches(dry_run=options["dry_run"])
+        prefix = "To be " if options["dry_run"] else ""
+        self.stdout.write(f"GitHub branches: {result['github_branches']}, tracked branches: {result['tracked_branches']}")
+        for key, label in (
+            ("created", "created in GitHub"),
+            ("fixed", "fixed in the database"),
+            ("deleted", "deleted from GitHub"),
+            ("orphan_rows", "removed orphan rows"),
+            ("unowned", "untracked branches left alone"),
+        ):
+            names = result[key]
+            self.stdout.write(f"{prefix}{label}: {len(names)}")
+            if options["verbosity"] > 1:
+                for name in names:
+                    self.stdout.write(f"  {name}")
+        for name, error in result["errors"]:
+            self.stderr.write(f"{name}: {error}")
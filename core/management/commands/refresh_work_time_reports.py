@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from core.reports import refresh_work_time_reports
+
+
+class Command(BaseCommand):
+    help = "Refreshes the materialized views behind the work time reports"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--blocking", action="store_true",
+            help="Refresh without CONCURRENTLY, faster but locks out readers"
+        )
+
+    def handle(self, *args, **options):
+        refresh_work_time_reports(concurrently=not options["blocking"])
+        self.stdout.write("Work time reports refreshed")
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.fake_github import FakeGitHubServer
+
+
+class Command(BaseCommand):
+    help = "Runs an in-memory fake GitHub API, use it via GITHUB_API_URL"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--repo", default=settings.GITHUB_REPO_NAME or "local/task-tracker")
+        parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+        parser.add_argument("--rate-limit", type=int, default=5000, help="Requests allowed per hour")
+        parser.add_argument(
+            "--no-native-rename", action="store_true", help="Answer 404 to branch renames, like servers without the endpoint"
+        )
+
+    def handle(self, *args, **options):
+        server = FakeGitHubServer(
+            options["repo"], port=options["port"], latency=options["latency"], rate_limit=options["rate_limit"],
+            native_rename=not options["no_native_rename"],
+        )
+        self.stdout.write(f"Fake GitHub for {options['repo']} listening on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
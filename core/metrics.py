@@ -0,0 +1,199 @@
+"""
+In-process request metrics: SQL and GitHub time per request, Prometheus
+histograms per view and per GitHub operation. Values are kept per worker process.
+"""
+import time
+from bisect import bisect_left
+from inspect import iscoroutinefunction
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = Lock()
+        self._series = {}
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def _labels(self, labels, **extra):
+        pairs = list(zip(self.labelnames, labels)) + list(extra.items())
+        return ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+            for labels, values in series:
+                cumulative = 0
+                for bound, count in zip(self.buckets, values["buckets"]):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{{{self._labels(labels, le=bound)}}} {cumulative}")
+                lines.append(f"{self.name}_bucket{{{self._labels(labels, le='+Inf')}}} {values['count']}")
+                lines.append(f"{self.name}_sum{{{self._labels(labels)}}} {values['sum']}")
+                lines.append(f"{self.name}_count{{{self._labels(labels)}}} {values['count']}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _counter(name, documentation, value):
+    name = f"{name}_total"
+    return [f"# HELP {name} {documentation}", f"# TYPE {name} counter", f"{name} {value}"]
+
+
+def _gauge(name, documentation, value):
+    return [f"# HELP {name} {documentation}", f"# TYPE {name} gauge", f"{name} {'NaN' if value is None else value}"]
+
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time spent in the Django view stack", ("view", "method")
+)
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "SQL queries per request", ("view", "method"), buckets=COUNT_BUCKETS
+)
+REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds", "Time spent in SQL per request", ("view", "method")
+)
+REQUEST_GITHUB_CALLS = Histogram(
+    "http_request_github_calls", "GitHub operations per request", ("view", "method"), buckets=COUNT_BUCKETS
+)
+GITHUB_CALL_DURATION = Histogram(
+    "github_call_duration_seconds", "Duration of GitHubService operations", ("operation", "outcome")
+)
+
+
+class RequestStats:
+    """Counters of the current request, GitHub calls may come from several pool threads"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.github_calls = 0
+        self.github_time = 0.0
+
+    def add_query(self, duration):
+        with self._lock:
+            self.db_queries += 1
+            self.db_time += duration
+
+    def add_github_call(self, duration):
+        with self._lock:
+            self.github_calls += 1
+            self.github_time += duration
+
+
+current_request = ContextVar("current_request_stats", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper installed on every connection. Queries count towards the
+    request whose context they run in, including sync_to_async threads of async views.
+    """
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(time.perf_counter() - started)
+
+
+_inside_github_call = ContextVar("inside_github_call", default=False)
+
+
+def instrumented(operation):
+    """
+    Times a GitHubService method, per operation and for the current request.
+    Calls made from inside another instrumented method are part of the outer one.
+    """
+    def record(started, outcome):
+        duration = time.perf_counter() - started
+        GITHUB_CALL_DURATION.observe(duration, operation, outcome)
+        stats = current_request.get()
+        if stats is not None:
+            stats.add_github_call(duration)
+
+    def decorator(func):
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _inside_github_call.get():
+                    return await func(*args, **kwargs)
+                token = _inside_github_call.set(True)
+                started = time.perf_counter()
+                outcome = "error"
+                try:
+                    result = await func(*args, **kwargs)
+                    outcome = "ok"
+                    return result
+                finally:
+                    _inside_github_call.reset(token)
+                    record(started, outcome)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _inside_github_call.get():
+                return func(*args, **kwargs)
+            token = _inside_github_call.set(True)
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                result = func(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                _inside_github_call.reset(token)
+                record(started, outcome)
+        return wrapper
+    return decorator
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    from .services import github_services, source_shas
+    from .github_scheduler import github_scheduler
+
+    lines = []
+    for histogram in (REQUEST_DURATION, REQUEST_DB_QUERIES, REQUEST_DB_DURATION, REQUEST_GITHUB_CALLS, GITHUB_CALL_DURATION):
+        lines.extend(histogram.render())
+    for name, value in source_shas.stats().items():
+        lines.extend(_counter(f"github_source_sha_cache_{name}", f"Source SHA cache {name} in this process", value))
+    for name, value in github_services.stats().items():
+        lines.extend(_counter(f"github_service_{name}", f"GitHub service registry {name} in this process", value))
+    budget = github_scheduler.stats()
+    for name, documentation in (
+        ("limit", "Requests GitHub allows per rate limit window"),
+        ("remaining", "Requests left in the GitHub rate limit window"),
+        ("reset_timestamp", "Unix time the GitHub rate limit window resets"),
+        ("bucket_tokens", "Requests the scheduler may send without waiting"),
+        ("in_flight", "GitHub requests in flight in this process"),
+    ):
+        lines.extend(_gauge(f"github_rate_limit_{name}", documentation, budget[name]))
+    for name in ("requests", "retries", "delayed", "rejected"):
+        lines.extend(_counter(f"github_scheduler_{name}", f"GitHub scheduler {name} in this process", budget[name]))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,63 @@
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from .metrics import (
+    REQUEST_DB_DURATION, REQUEST_DB_QUERIES, REQUEST_DURATION, REQUEST_GITHUB_CALLS, RequestStats, current_request
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetricsMiddleware:
+    """
+    Counts SQL queries and GitHub calls of every request, reports them in the
+    Server-Timing header and records them in the per-view histograms.
+    Works in both sync and async stacks, queries are counted by metrics.record_query.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_request.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_request.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, stats)
+
+    def finish(self, request, response, stats):
+        total = time.perf_counter() - stats.started
+        view = request.resolver_match.view_name if request.resolver_match else "unmatched"
+        REQUEST_DURATION.observe(total, view, request.method)
+        REQUEST_DB_QUERIES.observe(stats.db_queries, view, request.method)
+        REQUEST_DB_DURATION.observe(stats.db_time, view, request.method)
+        REQUEST_GITHUB_CALLS.observe(stats.github_calls, view, request.method)
+
+        response["Server-Timing"] = ", ".join([
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.db_queries} queries"',
+            f'github;dur={stats.github_time * 1000:.1f};desc="{stats.github_calls} calls"',
+            f"total;dur={total * 1000:.1f}",
+        ])
+        logger.debug(
+            "%s %s %s: %.1f ms, %d queries in %.1f ms, %d GitHub calls in %.1f ms",
+            request.method, request.path, response.status_code, total * 1000,
+            stats.db_queries, stats.db_time * 1000, stats.github_calls, stats.github_time * 1000,
+        )
+        return response
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:15
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_branchestask_user_task'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='branchestask',
+            name='state',
+            field=models.CharField(choices=[('pending', 'Pending'), ('active', 'Active'), ('failed', 'Failed')], default='active'),
+        ),
+        migrations.CreateModel(
+            name='BranchOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(blank=True, db_index=True, default=django.utils.timezone.now, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('branch', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='core.branchestask')),
+            ],
+        ),
+    ]
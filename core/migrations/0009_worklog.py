@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_branchestask_state_branchoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hours', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('logged_at', models.DateTimeField(auto_now_add=True)),
+                ('user_task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='work_logs', to='core.usertask')),
+            ],
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_worklog'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """
+                CREATE MATERIALIZED VIEW core_worktime_by_user AS
+                SELECT
+                    row_number() OVER (ORDER BY ut.user_id, t.type, t.status_id) AS id,
+                    ut.user_id,
+                    t.type AS task_type,
+                    t.status_id,
+                    COUNT(*) AS tasks,
+                    COALESCE(SUM(ut.work_time), 0) AS work_time,
+                    COALESCE(SUM(t.planned_time), 0) AS planned_time
+                FROM core_usertask ut
+                JOIN core_task t ON t.id = ut.task_id
+                GROUP BY ut.user_id, t.type, t.status_id
+                """,
+                "CREATE UNIQUE INDEX core_worktime_by_user_key ON core_worktime_by_user (user_id, task_type, status_id)",
+                """
+                CREATE MATERIALIZED VIEW core_worktime_by_task AS
+                SELECT
+                    row_number() OVER (ORDER BY t.type, t.status_id) AS id,
+                    t.type AS task_type,
+                    t.status_id,
+                    COUNT(*) AS tasks,
+                    COALESCE(SUM(ut.work_time), 0) AS work_time,
+                    COALESCE(SUM(t.planned_time), 0) AS planned_time
+                FROM core_task t
+                LEFT JOIN (
+                    SELECT task_id, SUM(work_time) AS work_time
+                    FROM core_usertask
+                    GROUP BY task_id
+                ) ut ON ut.task_id = t.id
+                GROUP BY t.type, t.status_id
+                """,
+                "CREATE UNIQUE INDEX core_worktime_by_task_key ON core_worktime_by_task (task_type, status_id)",
+            ],
+            reverse_sql=[
+                "DROP MATERIALIZED VIEW IF EXISTS core_worktime_by_task",
+                "DROP MATERIALIZED VIEW IF EXISTS core_worktime_by_user",
+            ],
+        ),
+        migrations.CreateModel(
+            name='WorkTimeByTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_type', models.CharField(blank=True, null=True)),
+                ('tasks', models.BigIntegerField()),
+                ('work_time', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('planned_time', models.DecimalField(decimal_places=2, max_digits=20)),
+            ],
+            options={
+                'db_table': 'core_worktime_by_task',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='WorkTimeByUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_type', models.CharField(blank=True, null=True)),
+                ('tasks', models.BigIntegerField()),
+                ('work_time', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('planned_time', models.DecimalField(decimal_places=2, max_digits=20)),
+            ],
+            options={
+                'db_table': 'core_worktime_by_user',
+                'managed': False,
+            },
+        ),
+    ]
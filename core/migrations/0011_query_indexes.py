@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:23
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY keeps the hot tables writable while the indexes build
+    atomic = False
+
+    dependencies = [
+        ('core', '0010_worktime_reports'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='branchestask',
+            index=models.Index(fields=['task', 'id'], name='branchestask_task_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='usertask',
+            index=models.Index(fields=['user', 'task'], include=('role',), name='usertask_user_task_role_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='usertask',
+            index=models.Index(condition=models.Q(('role', 'owner')), fields=['task'], include=('user',), name='usertask_task_owner_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='usertask',
+            index=models.Index(fields=['task', 'id'], name='usertask_task_id_idx'),
+        ),
+    ]
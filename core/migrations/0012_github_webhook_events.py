@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GitHubWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delivery_id', models.CharField(max_length=64, unique=True)),
+                ('event', models.CharField(max_length=20)),
+                ('branch', models.CharField()),
+                ('exists', models.BooleanField()),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='branchestask',
+            name='state',
+            field=models.CharField(choices=[('pending', 'Pending'), ('active', 'Active'), ('failed', 'Failed'), ('deleted', 'Deleted')], default='active'),
+        ),
+        migrations.AddIndex(
+            model_name='githubwebhookevent',
+            index=models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='webhookevent_pending_idx'),
+        ),
+    ]
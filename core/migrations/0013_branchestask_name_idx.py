@@ -0,0 +1,20 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:43
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY keeps the hot tables writable while the indexes build
+    atomic = False
+
+    dependencies = [
+        ('core', '0012_github_webhook_events'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='branchestask',
+            index=models.Index(fields=['name'], name='branchestask_name_idx'),
+        ),
+    ]
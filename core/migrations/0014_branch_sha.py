@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 20:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_branchestask_name_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='branchestask',
+            name='sha',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='githubwebhookevent',
+            name='sha',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_branch_sha'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='branchestask',
+            name='renaming_to',
+            field=models.CharField(blank=True, null=True),
+        ),
+    ]
@@ -1,5 +1,6 @@
-from django.db import models
+from django.db import connections, models, router
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 from django.utils.text import slugify
 from core.utils import update_branches_for_task
 
@@ -24,6 +25,57 @@ class UserTask(models.Model):
                 name='unique_user_task_participant'
             )
         ]
+        indexes = [
+            # Membership and owner checks by (user, task) and "my tasks" by user, answered from the index
+            models.Index(fields=['user', 'task'], include=['role'], name='usertask_user_task_role_idx'),
+            # Owners of a task
+            models.Index(
+                fields=['task'],
+                include=['user'],
+                condition=models.Q(role='owner'),
+                name='usertask_task_owner_idx'
+            ),
+            # Participants of a task in cursor pagination order
+            models.Index(fields=['task', 'id'], name='usertask_task_id_idx'),
+        ]
+
+class TaskQuerySet(models.QuerySet):
+    def reserve_ids(self, count):
+        """
+        Takes count ids from the table sequence, so slugs can be built before the INSERT.
+        Returns an empty list on databases without sequences.
+        """
+        connection = connections[self.db]
+        if connection.vendor != "postgresql" or count < 1:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                [self.model._meta.db_table, count]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def participated_by(self, user_id, role=None):
+        """
+        Tasks the user takes part in, with the user's role as my_role.
+        The filter and the annotation share one join through UserTask.
+        """
+        participation = {"usertask__user_id": user_id}
+        if role:
+            participation["usertask__role"] = role
+        return self.filter(**participation).annotate(my_role=models.F("usertask__role"))
+
+    def with_role_of(self, user_id):
+        """Annotates my_role with the user's role in each task, None for other tasks"""
+        return self.annotate(my_role=models.Subquery(
+            UserTask.objects.filter(task=models.OuterRef("pk"), user_id=user_id).values("role")[:1]
+        ))
+
+class WorkLog(models.Model):
+    """Append-only record of logged hours, UserTask.work_time holds their running total"""
+    user_task = models.ForeignKey(UserTask, on_delete=models.CASCADE, related_name="work_logs")
+    hours = models.DecimalField(max_digits=5, decimal_places=2)
+    logged_at = models.DateTimeField(auto_now_add=True)
 
 class Task(models.Model):
     class TaskType(models.TextChoices):
@@ -38,34 +90,151 @@ class Task(models.Model):
     planned_time = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     slug = models.CharField(unique=True ,blank=True, null=True)
 
+    objects = TaskQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_branch_fields()
+        return instance
+
+    def _remember_branch_fields(self):
+        """Keeps the values branch names depend on, so save() can detect renames without a SELECT"""
+        loaded = self.get_deferred_fields()
+        if "slug" in loaded or "type" in loaded:
+            self._loaded_branch_fields = None
+        else:
+            self._loaded_branch_fields = (self.slug, self.type)
+
+    def build_slug(self):
+        return slugify(f"{(self.name)}-{self.pk}")
+
     def save(self, *args, **kwargs):
-        is_new = self.pk is None
-        old_slug = None
-        old_type = None
-        if not is_new:
-            old_task = Task.objects.filter(pk=self.pk).only("slug", "type").first()
-            if old_task:
-                old_slug = old_task.slug
-                old_type = old_task.type
+        if self._state.adding:
+            self._insert(*args, **kwargs)
+            self._remember_branch_fields()
+            return
 
+        loaded = getattr(self, "_loaded_branch_fields", None)
+        if loaded is None:
+            loaded = Task.objects.filter(pk=self.pk).values_list("slug", "type").first() or (None, None)
+        old_slug, old_type = loaded
+
+        self.slug = self.build_slug()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and self.slug != old_slug:
+            kwargs["update_fields"] = {*update_fields, "slug"}
         super().save(*args, **kwargs)
-        
-        expected_slug = slugify(f"{(self.name)}-{self.pk}")
-        if not self.slug or self.slug != expected_slug:
-            self.slug = expected_slug
-            if is_new or old_slug != self.slug:
-                Task.objects.filter(pk=self.pk).update(slug=expected_slug)
-                # super().save(update_fields=['slug'])
-        if not is_new and old_task and old_slug != self.slug and old_type != self.type:
-            from core.utils import update_branches_for_task
+        self._remember_branch_fields()
+
+        if old_slug != self.slug or old_type != self.type:
             update_branches_for_task(self, old_slug, old_type)
 
+    def _insert(self, *args, **kwargs):
+        """
+        Inserts a new task with its final slug in one statement when the id can be
+        reserved up front, otherwise falls back to writing the slug after the INSERT.
+        """
+        if self.pk is None:
+            reserved = Task.objects.using(kwargs.get("using") or router.db_for_write(Task, instance=self)).reserve_ids(1)
+            if reserved:
+                self.pk = reserved[0]
+                kwargs["force_insert"] = True
+        if self.pk is not None:
+            self.slug = self.build_slug()
+            super().save(*args, **kwargs)
+            return
+        super().save(*args, **kwargs)
+        self.slug = self.build_slug()
+        Task.objects.filter(pk=self.pk).update(slug=self.slug)
+
 class Status(models.Model):
     name = models.CharField(max_length=50, unique=True)
 
 class BranchesTask(models.Model):
+    class State(models.TextChoices):
+        PENDING = "pending"
+        ACTIVE = "active"
+        FAILED = "failed"
+        # Removed on GitHub, e.g. after its pull request was merged
+        DELETED = "deleted"
+
     name = models.CharField()
     url = models.CharField(blank=True, null=True)
+    # Head commit as last seen: at creation, by reconciliation and by push webhooks
+    sha = models.CharField(max_length=40, blank=True, null=True)
+    # New name of a rename in flight, committed before GitHub is called
+    renaming_to = models.CharField(blank=True, null=True)
     task = models.ForeignKey("Task", on_delete=models.SET_NULL, blank=True, null=True)
     user_task = models.ForeignKey(UserTask, on_delete=models.CASCADE, blank=True, null=True)
+    state = models.CharField(choices=State.choices, default=State.ACTIVE)
 
+    class Meta:
+        indexes = [
+            # Branches of a task in cursor pagination order
+            models.Index(fields=['task', 'id'], name='branchestask_task_id_idx'),
+            # Webhook and reconciliation lookups by branch name
+            models.Index(fields=['name'], name='branchestask_name_idx'),
+        ]
+
+class BranchOutbox(models.Model):
+    """
+    Pending GitHub branch creation, written in the same transaction as the branch row.
+    Drained by the process_branch_outbox management command.
+    """
+    branch = models.OneToOneField(BranchesTask, on_delete=models.CASCADE, related_name="outbox")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, blank=True, null=True, db_index=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class GitHubWebhookEvent(models.Model):
+    """
+    Branch change received from a GitHub webhook, applied to BranchesTask in batches
+    by the process_webhook_events command. Redeliveries share the delivery id and are dropped.
+    """
+    delivery_id = models.CharField(max_length=64, unique=True)
+    event = models.CharField(max_length=20)
+    branch = models.CharField()
+    exists = models.BooleanField()
+    sha = models.CharField(max_length=40, blank=True, null=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Events waiting for the worker, in arrival order
+            models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True), name='webhookevent_pending_idx'),
+        ]
+
+
+class WorkTimeByUser(models.Model):
+    """
+    Read-only materialized view summing work and planned time per user, task type and status.
+    Planned time counts every task once per participant. Refreshed by core.reports.
+    """
+    user = models.ForeignKey("User", on_delete=models.DO_NOTHING, blank=True, null=True, related_name="+")
+    task_type = models.CharField(blank=True, null=True)
+    status = models.ForeignKey("Status", on_delete=models.DO_NOTHING, blank=True, null=True, related_name="+")
+    tasks = models.BigIntegerField()
+    work_time = models.DecimalField(max_digits=20, decimal_places=2)
+    planned_time = models.DecimalField(max_digits=20, decimal_places=2)
+
+    class Meta:
+        managed = False
+        db_table = "core_worktime_by_user"
+
+class WorkTimeByTask(models.Model):
+    """
+    Read-only materialized view summing work and planned time per task type and status.
+    Planned time counts every task once. Refreshed by core.reports.
+    """
+    task_type = models.CharField(blank=True, null=True)
+    status = models.ForeignKey("Status", on_delete=models.DO_NOTHING, blank=True, null=True, related_name="+")
+    tasks = models.BigIntegerField()
+    work_time = models.DecimalField(max_digits=20, decimal_places=2)
+    planned_time = models.DecimalField(max_digits=20, decimal_places=2)
+
+    class Meta:
+        managed = False
+        db_table = "core_worktime_by_task"
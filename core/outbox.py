@@ -0,0 +1,196 @@
+import logging
+import random
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+from .models import BranchesTask, BranchOutbox
+from .services import BranchAlreadyExists, get_github_service, run_concurrently
+from .caching import bump_task_versions
+from .async_github import gather_bounded, get_async_github_service
+
+logger = logging.getLogger(__name__)
+
+
+def claim_batch(batch_size):
+    """
+    Leases up to batch_size due outbox entries to the calling worker.
+    Leased entries are pushed BRANCH_OUTBOX_LEASE seconds into the future,
+    so a crashed worker's batch becomes due again without manual cleanup.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        entries = list(
+            BranchOutbox.objects
+            .select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=now)
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        if not entries:
+            return []
+        BranchOutbox.objects.filter(pk__in=[entry.pk for entry in entries]).update(
+            attempts=F("attempts") + 1,
+            next_attempt_at=now + timedelta(seconds=settings.BRANCH_OUTBOX_LEASE),
+        )
+    return list(
+        BranchOutbox.objects
+        .filter(pk__in=[entry.pk for entry in entries])
+        .select_related("branch")
+        .order_by("id")
+    )
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter, capped by BRANCH_OUTBOX_MAX_BACKOFF"""
+    delay = min(settings.BRANCH_OUTBOX_MAX_BACKOFF, settings.BRANCH_OUTBOX_BACKOFF * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def mark_done(entry, url, sha):
+    with transaction.atomic():
+        BranchesTask.objects.filter(pk=entry.branch_id).update(url=url, sha=sha, state=BranchesTask.State.ACTIVE)
+        entry.delete()
+        bump_task_versions(entry.branch.task_id)
+
+
+def mark_failed(entry, error, max_attempts):
+    if entry.attempts >= max_attempts:
+        with transaction.atomic():
+            BranchesTask.objects.filter(pk=entry.branch_id).update(state=BranchesTask.State.FAILED)
+            BranchOutbox.objects.filter(pk=entry.pk).update(next_attempt_at=None, last_error=error)
+            bump_task_versions(entry.branch.task_id)
+        return
+    BranchOutbox.objects.filter(pk=entry.pk).update(
+        next_attempt_at=timezone.now() + timedelta(seconds=retry_delay(entry.attempts)),
+        last_error=error,
+    )
+
+
+def mark_throttled(entries, error):
+    """
+    Puts entries back until the GitHub rate limit budget allows them. Waiting for the
+    budget is not a failure, so the attempt claim_batch counted is taken back.
+    """
+    BranchOutbox.objects.filter(pk__in=[entry.pk for entry in entries]).update(
+        attempts=F("attempts") - 1,
+        next_attempt_at=timezone.now() + timedelta(seconds=error.wait or settings.GITHUB_RATE_LIMIT_MAX_WAIT),
+        last_error=str(error),
+    )
+
+
+def create_on_github(branches, gh_service):
+    """
+    Creates the given branches concurrently from a single source SHA.
+    Returns (branch, (url, sha), error) tuples, a branch that already exists counts as
+    created with an unknown SHA.
+    """
+    source_sha = gh_service.get_source_sha()
+
+    def create(branch):
+        try:
+            return gh_service.create_branch(branch.name, source_sha=source_sha)
+        except BranchAlreadyExists:
+            # An earlier attempt created the ref but did not get to record it
+            return gh_service.branch_url(branch.name), None
+
+    return run_concurrently(create, branches)
+
+
+def process_batch(batch_size=None, max_attempts=None):
+    """
+    Drains one batch of the branch outbox. Entries held back by the GitHub rate limit
+    budget are rescheduled for when it allows them, without using up an attempt.
+    Returns a (succeeded, failed) tuple, (0, 0) when nothing was due.
+    """
+    batch_size = batch_size or settings.BRANCH_OUTBOX_BATCH_SIZE
+    max_attempts = max_attempts or settings.BRANCH_OUTBOX_MAX_ATTEMPTS
+
+    entries = claim_batch(batch_size)
+    if not entries:
+        return 0, 0
+    try:
+        gh_service = get_github_service()
+        results = create_on_github([entry.branch for entry in entries], gh_service)
+    except Throttled as e:
+        mark_throttled(entries, e)
+        return 0, len(entries)
+    except Exception as e:
+        for entry in entries:
+            mark_failed(entry, str(e), max_attempts)
+        return 0, len(entries)
+
+    succeeded = 0
+    throttled = {}
+    for entry, (_, created, error) in zip(entries, results):
+        if isinstance(error, Throttled):
+            throttled[entry] = error
+        elif error:
+            mark_failed(entry, str(error), max_attempts)
+        else:
+            mark_done(entry, *created)
+            succeeded += 1
+    if throttled:
+        mark_throttled(list(throttled), max(throttled.values(), key=lambda error: error.wait or 0))
+    return succeeded, len(entries) - succeeded
+
+
+async def acreate_on_github(branches, gh_service):
+    """Async create_on_github() for the async views"""
+    source_sha = await gh_service.get_source_sha()
+
+    async def create(branch):
+        try:
+            return await gh_service.create_branch(branch.name, source_sha=source_sha)
+        except BranchAlreadyExists:
+            return gh_service.branch_url(branch.name), None
+
+    return await gather_bounded(create, branches)
+
+
+def create_queued_branches(branches):
+    """
+    Creates freshly queued branches right away instead of waiting for the worker.
+    Branches that fail stay in the outbox, so the worker retries them.
+    """
+    if not branches:
+        return branches
+    try:
+        results = create_on_github(branches, get_github_service())
+    except Exception as e:
+        logger.warning("Branches left to the outbox worker: %s", e)
+        return branches
+    record_created_branches(results)
+    return branches
+
+
+async def acreate_queued_branches(branches):
+    """Async create_queued_branches(), GitHub calls share the event loop's connection pool"""
+    if not branches:
+        return branches
+    try:
+        results = await acreate_on_github(branches, get_async_github_service())
+    except Exception as e:
+        logger.warning("Branches left to the outbox worker: %s", e)
+        return branches
+    await sync_to_async(record_created_branches)(results)
+    return branches
+
+
+def record_created_branches(results):
+    """Marks the branches GitHub created as active and takes them off the outbox"""
+    created = []
+    for branch, result, error in results:
+        if error:
+            logger.warning("Branch %s left to the outbox worker: %s", branch.name, error)
+            continue
+        branch.url, branch.sha = result
+        branch.state = BranchesTask.State.ACTIVE
+        created.append(branch)
+    if created:
+        with transaction.atomic():
+            BranchesTask.objects.bulk_update(created, ["url", "sha", "state"])
+            BranchOutbox.objects.filter(branch__in=created).delete()
+            bump_task_versions(*{branch.task_id for branch in created})
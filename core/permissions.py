@@ -1,67 +1,68 @@
 from rest_framework import permissions
 from .models import UserTask, Task
 
+
+def get_task_pk(view):
+    return view.kwargs.get('task_pk') or view.kwargs.get('pk')
+
+
+def get_task_membership(request, task_pk):
+    """
+    Returns a (role,) tuple for the task participant, None if the user does not take part.
+    The lookup is made once per request and task, and shared by permissions and views.
+    """
+    try:
+        task_pk = int(task_pk)
+    except (TypeError, ValueError):
+        return None
+    memberships = getattr(request, '_task_memberships', None)
+    if memberships is None:
+        memberships = request._task_memberships = {}
+    if task_pk not in memberships:
+        memberships[task_pk] = UserTask.objects.filter(
+            user_id=request.user.id,
+            task_id=task_pk
+        ).values_list('role').first()
+    return memberships[task_pk]
+
+
+def get_task_role(request, task_pk):
+    membership = get_task_membership(request, task_pk)
+    return membership[0] if membership else None
+
+
+def get_object_task_pk(obj):
+    if isinstance(obj, Task):
+        return obj.pk
+    return getattr(obj, 'task_id', None)
+
+
 class IsTaskOwner(permissions.BasePermission):
-    def _get_task(self, view):
-        task_pk = view.kwargs.get('task_pk')
-        if not task_pk:
-            task_pk = view.kwargs.get('pk')
-        if not task_pk:
-            return None
-        try:
-            return Task.objects.get(pk=task_pk)
-        except Task.DoesNotExist:
-            return None
-        
     def has_permission(self, request, view):
-        task = self._get_task(view)
-        if not task:
+        task_pk = get_task_pk(view)
+        if not task_pk:
             return False
-        return UserTask.objects.filter(
-            user=request.user,
-            task=task,
-            role=UserTask.Role.OWNER
-        ).exists()
-    
+        return get_task_role(request, task_pk) == UserTask.Role.OWNER
+
     def has_object_permission(self, request, view, obj):
-        if isinstance(obj, Task):
-            task = obj
-        elif hasattr(obj, 'task'):
-            task = obj.task
-        else: 
+        task_pk = get_object_task_pk(obj)
+        if task_pk is None:
             return False
-        return UserTask.objects.filter(
-            user=request.user,
-            task=task,
-            role=UserTask.Role.OWNER
-        ).exists()
-    
+        return get_task_role(request, task_pk) == UserTask.Role.OWNER
+
 class IsParticipantOfTask(permissions.BasePermission):
     def has_permission(self, request, view):
-        task_pk = view.kwargs.get('task_pk')
+        task_pk = get_task_pk(view)
         if not task_pk:
-            task_pk = view.kwargs.get('pk')
-            if not task_pk:
-                return True
-            
-        
-        try:
-            task = Task.objects.get(pk=task_pk)
-        except Task.DoesNotExist:
-            return False
-        
-        return UserTask.objects.filter(user=request.user, task=task).exists()
-    
+            return True
+        return get_task_membership(request, task_pk) is not None
+
     def has_object_permission(self, request, view, obj):
-        if isinstance(obj, Task):
-            task = obj
-        elif hasattr(obj, 'task'):
-            task = obj.task
-        else: 
+        task_pk = get_object_task_pk(obj)
+        if task_pk is None:
             return False
-        
-        return UserTask.objects.filter(user=request.user, task=task).exists()
-    
+        return get_task_membership(request, task_pk) is not None
+
 class IsSelf(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        return obj.user == request.user
+        return obj.user_id == request.user.id
@@ -0,0 +1,120 @@
+"""
+Brings BranchesTask rows and the branches in GitHub back in line. GitHub is listed
+once with matching-refs and diffed against the table in memory, so the cost does
+not grow with per-branch lookups.
+"""
+import logging
+import re
+from django.db import transaction
+from .models import BranchesTask, BranchOutbox, Task
+from .outbox import create_on_github, record_created_branches
+from .services import get_github_service, run_concurrently
+from .caching import bump_task_versions
+
+logger = logging.getLogger(__name__)
+
+# Names built by create_branch_name, other branches of the repo are never touched
+MANAGED_BRANCH = re.compile(rf"^({'|'.join(Task.TaskType.values)})/\d+/")
+
+
+def diff_branches(github, rows, branch_url):
+    """
+    Compares the managed GitHub branches ({name: sha}) with BranchesTask rows.
+    Returns the rows to create in GitHub, the rows to fix, the orphan refs, the unowned
+    refs and the orphan rows. Orphan refs belong to rows of deleted tasks, so the tracker
+    created them. Unowned refs only follow the naming and may have been made by hand.
+    Pending rows belong to the outbox worker and rows being renamed to their rename,
+    both are left alone. Rows of branches reported deleted by the webhook are only
+    revived when the branch shows up again.
+    """
+    tracked = {row.name for row in rows if row.task_id is not None}
+    tracked.update(row.renaming_to for row in rows if row.task_id is not None and row.renaming_to)
+    orphaned = {row.name for row in rows if row.task_id is None}
+    missing = []
+    to_fix = []
+    orphan_rows = []
+    for row in rows:
+        if row.task_id is None:
+            orphan_rows.append(row)
+        elif row.state == BranchesTask.State.PENDING or row.renaming_to:
+            continue
+        elif row.name not in github:
+            # Branches deleted on GitHub on purpose stay deleted
+            if row.state != BranchesTask.State.DELETED:
+                missing.append(row)
+        elif (row.state, row.url, row.sha) != (BranchesTask.State.ACTIVE, branch_url(row.name), github[row.name]):
+            to_fix.append(row)
+    untracked = set(github) - tracked
+    return missing, to_fix, sorted(untracked & orphaned), sorted(untracked - orphaned), orphan_rows
+
+
+def reconcile_branches(dry_run=False):
+    """
+    Lists the repo's branches, then creates the missing ones, fixes url, head SHA and state
+    of rows whose branch exists and deletes the branches of deleted tasks. Branches that
+    follow the naming but were never tracked are only reported.
+    GitHub writes run concurrently, database writes in batches.
+    Returns branch counts and the names affected, (name, error) pairs of failures.
+    """
+    gh_service = get_github_service()
+    github = {
+        name: sha for name, sha in gh_service.list_branches().items() if MANAGED_BRANCH.match(name)
+    }
+    rows = list(BranchesTask.objects.only("id", "name", "url", "sha", "state", "renaming_to", "task_id").iterator(chunk_size=5000))
+    missing, to_fix, orphan_refs, unowned_refs, orphan_rows = diff_branches(github, rows, gh_service.branch_url)
+    result = {
+        "github_branches": len(github),
+        "tracked_branches": len(rows),
+        "created": [row.name for row in missing],
+        "fixed": [row.name for row in to_fix],
+        "deleted": orphan_refs,
+        "unowned": unowned_refs,
+        "orphan_rows": [row.pk for row in orphan_rows],
+        "errors": [],
+    }
+    if dry_run:
+        return result
+
+    if missing:
+        results = create_on_github(missing, gh_service)
+        record_created_branches(results)
+        result["created"] = [branch.name for branch, _, error in results if not error]
+        result["errors"] += [(branch.name, str(error)) for branch, _, error in results if error]
+
+    if to_fix:
+        for row in to_fix:
+            row.url = gh_service.branch_url(row.name)
+            row.sha = github[row.name]
+            row.state = BranchesTask.State.ACTIVE
+        with transaction.atomic():
+            BranchesTask.objects.bulk_update(to_fix, ["url", "sha", "state"], batch_size=1000)
+            BranchOutbox.objects.filter(branch__in=to_fix).delete()
+            bump_task_versions(*{row.task_id for row in to_fix})
+
+    undeleted = set()
+    if orphan_refs:
+        # Rows written since the snapshot, e.g. by a rename in flight, keep their branch
+        claimed = set(
+            BranchesTask.objects.filter(name__in=orphan_refs, task__isnull=False).values_list("name", flat=True)
+        ) | set(
+            BranchesTask.objects.filter(renaming_to__in=orphan_refs, task__isnull=False)
+            .values_list("renaming_to", flat=True)
+        )
+        results = run_concurrently(gh_service.delete_branch, [name for name in orphan_refs if name not in claimed])
+        result["deleted"] = [name for name, _, error in results if not error]
+        result["errors"] += [(name, str(error)) for name, _, error in results if error]
+        undeleted = {name for name, _, error in results if error}
+
+    # A row whose branch could not be deleted keeps the name for the next run
+    removable = [row.pk for row in orphan_rows if row.name not in undeleted]
+    if removable:
+        BranchesTask.objects.filter(pk__in=removable, task__isnull=True).delete()
+
+    for name, error in result["errors"]:
+        logger.error("Branch reconciliation failed for %s: %s", name, error)
+    logger.info(
+        "Branches reconciled: %s created, %s fixed, %s deleted, %s orphan rows removed, %s unowned left alone",
+        len(result["created"]), len(result["fixed"]), len(result["deleted"]), len(result["orphan_rows"]),
+        len(result["unowned"]),
+    )
+    return result
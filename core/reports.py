@@ -0,0 +1,54 @@
+from django.db import connection
+from django.db.models import Sum
+from .models import WorkTimeByTask, WorkTimeByUser
+
+REPORT_VIEWS = ("core_worktime_by_user", "core_worktime_by_task")
+
+GROUP_FIELDS = {
+    "user": {"user_id": "user_id", "username": "user__username"},
+    "type": {"type": "task_type"},
+    "status": {"status": "status__name"},
+}
+
+
+def refresh_work_time_reports(concurrently=True):
+    """Recomputes the report materialized views, CONCURRENTLY keeps them readable meanwhile"""
+    with connection.cursor() as cursor:
+        for view in REPORT_VIEWS:
+            cursor.execute(f"REFRESH MATERIALIZED VIEW {'CONCURRENTLY ' if concurrently else ''}{view}")
+
+
+def work_time_report(group_by, user=None):
+    """
+    Sums work time against planned time from the report views, grouped by
+    any of "user", "type" and "status". With user given only their rows are used.
+    Groups without "user" read the per task view, so planned time is counted once per task.
+    """
+    if user is not None or "user" in group_by:
+        rows = WorkTimeByUser.objects.all()
+    else:
+        rows = WorkTimeByTask.objects.all()
+    if user is not None:
+        rows = rows.filter(user_id=user.id)
+
+    columns = {}
+    for key in group_by:
+        columns.update(GROUP_FIELDS[key])
+    rows = (
+        rows.values(*columns.values())
+        .annotate(
+            task_count=Sum("tasks"),
+            work_time_total=Sum("work_time"),
+            planned_time_total=Sum("planned_time"),
+        )
+        .order_by(*columns.values())
+    )
+    return [
+        {
+            **{name: row[field] for name, field in columns.items()},
+            "tasks": row["task_count"],
+            "work_time": row["work_time_total"],
+            "planned_time": row["planned_time_total"],
+        }
+        for row in rows
+    ]
@@ -1,8 +1,48 @@
 from rest_framework import serializers
-from django.db import transaction
-from .models import Status, Task, User, UserTask, BranchesTask
-from .utils import create_branch_and_task_record, update_branches_for_task
-from .services import GitHubService
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from decimal import Decimal
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, F, Value, prefetch_related_objects
+from django.db.models.functions import Coalesce
+from .models import Task, User, UserTask, BranchesTask, WorkLog
+from .utils import (
+    bulk_create_tasks, enqueue_branch_creation, enqueue_branch_creations, mark_branch_renames, update_branches_for_task
+)
+from .outbox import create_queued_branches
+from .reports import GROUP_FIELDS
+from .caching import bump_task_versions
+from .services import get_github_service
+from .statuses import status_registry
+from .authentication import add_user_claims, get_full_user
+
+class TokenObtainPairWithClaimsSerializer(TokenObtainPairSerializer):
+    """Adds the username claim, so stateless authentication needs no User row"""
+
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
+
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refuses refresh tokens issued before the user's password was changed. The password
+    is read from the database, not from the per-process user cache, so a change made
+    through another worker takes effect at once.
+    """
+
+    def validate(self, attrs):
+        if jwt_settings.CHECK_REVOKE_TOKEN:
+            refresh = RefreshToken(attrs['refresh'])
+            password = User.objects.filter(
+                pk=int(refresh[jwt_settings.USER_ID_CLAIM])
+            ).values_list('password', flat=True).first()
+            if password is None or refresh.get(jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(password):
+                raise AuthenticationFailed("The user's password has been changed.", code="password_changed")
+        return super().validate(attrs)
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -24,17 +64,16 @@ class UserSerializer(serializers.ModelSerializer):
 class BranchesTaskSerializer(serializers.ModelSerializer):
     class Meta:
         model = BranchesTask
-        fields = ("id", "name", "url", "task")
-        read_only_fields = ("task", "url")
+        fields = ("id", "name", "url", "sha", "task", "state")
+        read_only_fields = ("task", "url", "sha", "state")
 
     def create(self, validated_data):
         task_id = self.context["view"].kwargs["task_pk"]
         validated_data["task_id"] = task_id
         branch_name = validated_data["name"]
 
-        gh_service = GitHubService()
-        branch_url = gh_service.create_branch(branch_name)
-        validated_data["url"] = branch_url
+        gh_service = get_github_service()
+        validated_data["url"], validated_data["sha"] = gh_service.create_branch(branch_name)
 
         return super().create(validated_data)
 
@@ -42,42 +81,105 @@ class BranchesTaskSerializer(serializers.ModelSerializer):
         new_name = validated_data.get("name")
         if not new_name or new_name == instance.name:
             return super().update(instance, validated_data)
-        gh_service = GitHubService()
-        with transaction.atomic():
-            new_url = gh_service.rename_branch(instance.name, new_name)
-            validated_data["url"] = new_url
-            instance = super().update(instance, validated_data)
-        return instance
+        gh_service = get_github_service()
+        resume = mark_branch_renames([(instance, new_name)])[instance.pk]
+        try:
+            new_url = gh_service.rename_branch(instance.name, new_name, sha=instance.sha, resume=resume)
+        except Exception:
+            BranchesTask.objects.filter(pk=instance.pk).update(renaming_to=None)
+            raise
+        validated_data["url"] = new_url
+        validated_data["state"] = BranchesTask.State.ACTIVE
+        validated_data["renaming_to"] = None
+        return super().update(instance, validated_data)
     
 
+class StatusField(serializers.Field):
+    """
+    Status name in and out, backed by status_id and resolved through the
+    in-process status registry instead of the Status table.
+    """
+    default_error_messages = {
+        'does_not_exist': 'Status with name={value} does not exist.',
+        'invalid': 'Invalid value.',
+    }
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', 'status_id')
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str):
+            self.fail('invalid')
+        status_id = status_registry.id(data)
+        if status_id is None:
+            self.fail('does_not_exist', value=data)
+        return status_id
+
+    def to_representation(self, value):
+        return status_registry.name(value)
+
+
 class TaskSerializer(serializers.ModelSerializer):
-    status = serializers.SlugRelatedField(
-        slug_field='name',
-        queryset=Status.objects.all()
-    )
-    branches = serializers.SerializerMethodField()
+    status = StatusField()
+    branches = BranchesTaskSerializer(source="branchestask_set", many=True, read_only=True)
+    my_role = serializers.SerializerMethodField()
 
     class Meta:
         model = Task
-        fields = ("id", "name", "description", "status", "type", "planned_time", "slug", "branches")
-        read_only_fields = ("slug", "branches")
+        fields = ("id", "name", "description", "status", "type", "planned_time", "slug", "branches", "my_role")
+        read_only_fields = ("slug", "branches", "my_role")
 
-    def get_branches(self, obj):
-        branches = BranchesTask.objects.filter(task=obj)
-        return BranchesTaskSerializer(branches, many=True).data
+    def get_my_role(self, obj):
+        return getattr(obj, "my_role", None)
 
 
+    @transaction.atomic
     def create(self, validated_data):
-        user = self.context['request'].user
+        user = get_full_user(self.context['request'].user)
         task = Task.objects.create(**validated_data)
-        task.refresh_from_db()
         user_task = UserTask.objects.create(
             user=user,
             task=task,
             role=UserTask.Role.OWNER
         )
-        create_branch_and_task_record(user_task)
+        enqueue_branch_creation(user_task)
+        task.my_role = user_task.role
         return task
+
+
+class TaskBulkCreateSerializer(serializers.Serializer):
+    """
+    Validates every task on its own, so invalid items are reported
+    without rejecting the valid ones, which are inserted in bulk.
+    """
+    tasks = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=settings.TASK_BULK_MAX_ITEMS
+    )
+
+    def create(self, validated_data):
+        user = get_full_user(self.context['request'].user)
+        results = []
+        valid = []
+        # One serializer for all items, so its fields are built once rather than per item
+        item_serializer = TaskSerializer(context=self.context)
+        for index, item in enumerate(validated_data['tasks']):
+            try:
+                valid.append((index, item_serializer.run_validation(item)))
+            except serializers.ValidationError as e:
+                results.append({"index": index, "status": "invalid", "errors": e.detail})
+
+        with transaction.atomic():
+            tasks = bulk_create_tasks([data for _, data in valid], user)
+        prefetch_related_objects(tasks, "branchestask_set")
+        for task in tasks:
+            task.my_role = UserTask.Role.OWNER
+        created = TaskSerializer(tasks, many=True, context=self.context).data
+        for (index, _), task in zip(valid, created):
+            results.append({"index": index, "status": "created", "task": task})
+        return sorted(results, key=lambda result: result["index"])
     
     
 class UserTaskSerializer(serializers.ModelSerializer):
@@ -88,17 +190,79 @@ class UserTaskSerializer(serializers.ModelSerializer):
         fields = ("id", "user", "user_name", "task", "work_time", "role")
         read_only_fields = ('task', 'work_time')
 
+    @transaction.atomic
     def create(self, validated_data):
         task_id = self.context['view'].kwargs['task_pk']
         validated_data['task_id'] = task_id
         user_task = super().create(validated_data)
-        create_branch_and_task_record(user_task)
+        enqueue_branch_creation(user_task)
         return user_task
 
 class ManageParticipantSerializer(serializers.Serializer):
     user_id = serializers.IntegerField()
     role = serializers.ChoiceField(choices=UserTask.Role.choices)
 
+class UserTaskBulkCreateSerializer(serializers.Serializer):
+    """
+    Adds many participants to a task in one transaction. Users that do not exist
+    or already take part are reported per item, the branches of the added ones
+    are created concurrently once the rows are committed.
+    """
+    participants = ManageParticipantSerializer(
+        many=True,
+        allow_empty=False,
+        max_length=settings.PARTICIPANT_BULK_MAX_ITEMS
+    )
+
+    def create(self, validated_data):
+        results, added = self.add_participants(validated_data)
+        create_queued_branches([branch for _, _, branch in added])
+        return self.report(results, added)
+
+    def add_participants(self, validated_data):
+        """
+        Inserts the valid participants with their queued branches.
+        Returns per-item results of the rejected ones and (index, user_task, branch) of the added ones.
+        """
+        task = Task.objects.get(pk=self.context['view'].kwargs['task_pk'])
+        participants = validated_data['participants']
+        user_ids = [participant['user_id'] for participant in participants]
+        users = User.objects.in_bulk(user_ids)
+        taken = set(
+            UserTask.objects.filter(task=task, user_id__in=user_ids).values_list('user_id', flat=True)
+        )
+
+        results = {}
+        to_add = []
+        for index, participant in enumerate(participants):
+            user_id = participant['user_id']
+            if user_id not in users:
+                results[index] = {"index": index, "user_id": user_id, "status": "invalid", "errors": ["User does not exist"]}
+            elif user_id in taken:
+                results[index] = {"index": index, "user_id": user_id, "status": "invalid", "errors": ["User already takes part in the task"]}
+            else:
+                taken.add(user_id)
+                to_add.append((index, UserTask(user=users[user_id], task=task, role=participant['role'])))
+
+        try:
+            with transaction.atomic():
+                user_tasks = UserTask.objects.bulk_create([user_task for _, user_task in to_add])
+                branches = enqueue_branch_creations(user_tasks)
+        except IntegrityError:
+            raise serializers.ValidationError("Participants of the task changed concurrently, retry the request")
+        return results, [(index, user_task, branch) for (index, user_task), branch in zip(to_add, branches)]
+
+    def report(self, results, added):
+        for index, user_task, branch in added:
+            results[index] = {
+                "index": index,
+                "user_id": user_task.user_id,
+                "status": "added",
+                "participant": UserTaskSerializer(user_task, context=self.context).data,
+                "branch": BranchesTaskSerializer(branch, context=self.context).data,
+            }
+        return [results[index] for index in sorted(results)]
+
 class LogWorkTimeSerializer(serializers.ModelSerializer):
     hours = serializers.DecimalField(max_digits=5, decimal_places=2, write_only=True)
 
@@ -112,25 +276,45 @@ class LogWorkTimeSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Hours must be positive")
         return value
     
+    @transaction.atomic
     def update(self, instance, validated_data):
-        hours_to_add = validated_data.get('hours', 0)
-        current_work_time = instance.work_time or 0
-        instance.work_time = current_work_time + hours_to_add
-        instance.save()
+        hours_to_add = validated_data['hours']
+        WorkLog.objects.create(user_task=instance, hours=hours_to_add)
+        UserTask.objects.filter(pk=instance.pk).update(
+            work_time=Coalesce(F('work_time'), Value(Decimal(0)), output_field=DecimalField()) + hours_to_add
+        )
+        bump_task_versions(instance.task_id)
+        instance.refresh_from_db(fields=['work_time'])
         return instance
     
+class TaskListQuerySerializer(serializers.Serializer):
+    mine = serializers.BooleanField(required=False, default=False)
+    role = serializers.ChoiceField(choices=UserTask.Role.choices, required=False)
+    status = serializers.CharField(required=False)
+    type = serializers.ChoiceField(choices=Task.TaskType.choices, required=False)
+
+class WorkTimeReportQuerySerializer(serializers.Serializer):
+    group_by = serializers.CharField(required=False, default="user,type,status")
+
+    def validate_group_by(self, value):
+        keys = [key.strip() for key in value.split(",") if key.strip()]
+        unknown = set(keys) - set(GROUP_FIELDS)
+        if not keys or unknown:
+            raise serializers.ValidationError(f"Group by any of: {', '.join(GROUP_FIELDS)}")
+        return list(dict.fromkeys(keys))
+    
 class ChangePasswordSerializer(serializers.Serializer):
     old_password = serializers.CharField(required=True, write_only=True)
     new_password = serializers.CharField(required=True, write_only=True)
 
     def validate_old_password(self, value):
-        user = self.context['request'].user
+        user = get_full_user(self.context['request'].user)
         if not user.check_password(value):
             raise serializers.ValidationError("Your old password was entered incorrectly. Please enter it again.")
         return value
 
     def save(self, **kwargs):
-        user = self.context['request'].user
+        user = get_full_user(self.context['request'].user)
         new_password = self.validated_data['new_password']
         user.set_password(new_password)
         user.save()
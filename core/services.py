@@ -1,58 +1,313 @@
-from github import Github, GithubException
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from threading import Lock
+from urllib.parse import quote
+from github import Auth, Github, GithubException
+from urllib3.util import Retry
 from django.conf import settings
+from django.core.cache import cache
 from rest_framework.exceptions import ValidationError
+from .metrics import instrumented
+from . import github_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class BranchAlreadyExists(ValidationError):
+    pass
+
+
+class SourceShaCache:
+    """
+    Short-lived cache of source branch head SHAs, kept in Django's cache so
+    all workers share it. Hit and miss counters are per process.
+    """
 
-class GitHubService:
     def __init__(self):
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _key(self, branch):
+        return f"github:sha:{settings.GITHUB_REPO_NAME}:{branch}"
+
+    def _count(self, sha):
+        with self._lock:
+            if sha:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, fetch, branch):
+        """SHA of the branch head, fetch(branch) is called for it on a miss"""
+        sha = cache.get(self._key(branch))
+        self._count(sha)
+        if sha:
+            return sha
+        sha = fetch(branch)
+        cache.set(self._key(branch), sha, settings.GITHUB_SHA_CACHE_TTL)
+        return sha
+
+    async def aget(self, fetch, branch):
+        """Async get(), fetch(branch) is awaited for the SHA on a miss"""
+        sha = await cache.aget(self._key(branch))
+        self._count(sha)
+        if sha:
+            return sha
+        sha = await fetch(branch)
+        await cache.aset(self._key(branch), sha, settings.GITHUB_SHA_CACHE_TTL)
+        return sha
+
+    def invalidate(self, branch):
+        cache.delete(self._key(branch))
+        with self._lock:
+            self.invalidations += 1
+
+    async def ainvalidate(self, branch):
+        await cache.adelete(self._key(branch))
+        with self._lock:
+            self.invalidations += 1
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+source_shas = SourceShaCache()
+
+
+def is_stale_sha_error(e):
+    """GitHub answers 422 when a ref is created from a SHA that no longer exists"""
+    message = str(e.data).lower()
+    return e.status == 422 and ("object does not exist" in message or "reference does not exist" in message)
+
+
+class GitHubService:
+    def __init__(self, client=None):
         if not settings.GITHUB_ACCESS_TOKEN or not settings.GITHUB_REPO_NAME:
             raise ValidationError(f"GitHub configuration is missing in settings")
 
-        self.client = Github(settings.GITHUB_ACCESS_TOKEN)
+        if client is None:
+            github_scheduler.install()
+        self.client = client or Github(
+            auth=Auth.Token(settings.GITHUB_ACCESS_TOKEN),
+            # Rate limits are retried by the scheduler, urllib3 only retries server errors of
+            # idempotent requests. A write may have been applied before a 502, a blind retry
+            # would fail on its own ref, the outbox retries creates and accepts an existing ref
+            retry=Retry(
+                total=settings.GITHUB_SERVER_ERROR_RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                raise_on_status=False,
+            ),
+            base_url=settings.GITHUB_API_URL,
+            pool_size=settings.GITHUB_POOL_SIZE,
+            seconds_between_requests=settings.GITHUB_SECONDS_BETWEEN_REQUESTS,
+            seconds_between_writes=settings.GITHUB_SECONDS_BETWEEN_WRITES,
+            per_page=settings.GITHUB_PER_PAGE,
+        )
+        self.repo = self._get_repo()
+
+    @instrumented("get_repo")
+    def _get_repo(self):
         try:
-            self.repo = self.client.get_repo(settings.GITHUB_REPO_NAME)
+            return self.client.get_repo(settings.GITHUB_REPO_NAME)
         except Exception as e:
             raise ValidationError(f"Could not connect to GitHub repo: {str(e)}")
 
-    def create_branch(self, branch_name, source_branch="main"):
-        """Created a branch in GitHub"""
+    @staticmethod
+    def branch_url(branch_name):
+        return f"https://github.com/{settings.GITHUB_REPO_NAME}/tree/{branch_name}"
+
+    def get_source_sha(self, source_branch="main"):
+        return source_shas.get(self._branch_sha, source_branch)
+
+    # Only cache misses reach GitHub, so only they are timed as calls
+    @instrumented("get_source_sha")
+    def _branch_sha(self, branch_name):
+        return self.repo.get_branch(branch_name).commit.sha
+
+    @instrumented("create_branch")
+    def create_branch(self, branch_name, source_branch="main", source_sha=None):
+        """
+        Created a branch in GitHub, from source_sha when the caller already knows it.
+        Returns the branch url and the SHA it points to.
+        """
         try:
-            source_branch = self.repo.get_branch(source_branch)
-            source_sha = source_branch.commit.sha
-            self.repo.create_git_ref(f"refs/heads/{branch_name}", sha=source_sha)
-            return f"https://github.com/{settings.GITHUB_REPO_NAME}/tree/{branch_name}"
+            try:
+                sha = source_sha or self.get_source_sha(source_branch)
+                self.repo.create_git_ref(f"refs/heads/{branch_name}", sha=sha)
+            except GithubException as e:
+                if not is_stale_sha_error(e):
+                    raise
+                source_shas.invalidate(source_branch)
+                sha = self.get_source_sha(source_branch)
+                self.repo.create_git_ref(f"refs/heads/{branch_name}", sha=sha)
+            return self.branch_url(branch_name), sha
         except GithubException as e:
             if e.status == 422 and "already exists" in str(e.data).lower():
-                raise ValidationError(f"Branch already exists in GitHub: {branch_name}")
+                raise BranchAlreadyExists(f"Branch already exists in GitHub: {branch_name}")
             else:
                 raise ValidationError(f"GitHub error: {e.data.get('message', str(e))}")
 
-    def rename_branch(self, old_name, new_name):
-        """Renames branch by creating a new one and deleting the old one"""
+    @instrumented("rename_branch")
+    def rename_branch(self, old_name, new_name, sha=None, resume=False):
+        """
+        Renames a branch with GitHub's rename endpoint, a single call. Where that is not
+        available, copies the branch to the new name and deletes the old one.
+        sha is the branch head known to the caller, used when the old branch is gone.
+        resume is set when the caller's row was already being renamed to new_name,
+        so a copy found at new_name is its own, left by an interrupted attempt.
+        """
+        if settings.GITHUB_NATIVE_RENAME:
+            # PyGithub's rename_branch() only returns a bool, the status decides about the fallback
+            status, _, data = self.repo._requester.requestJson(
+                "POST", f"{self.repo.url}/branches/{quote(old_name)}/rename", input={"new_name": new_name}
+            )
+            if status == 201:
+                return self.branch_url(new_name)
+            if status not in (404, 501):
+                message = self._message(data)
+                if status == 422:
+                    raise ValidationError(f"Failed to rename branch '{old_name}' to '{new_name}': {message}")
+                raise ValidationError(f"GitHub error: {message}")
+        return self._rename_by_copy(old_name, new_name, sha, resume)
+
+    @staticmethod
+    def _message(data):
+        try:
+            return json.loads(data).get("message", data)
+        except (TypeError, ValueError, AttributeError):
+            return data
+
+    def _rename_by_copy(self, old_name, new_name, sha, resume):
+        """
+        Creates the new ref at the old branch's head, then deletes the old ref through the
+        same ref object, three calls. A missing old branch is recreated under the new name from sha.
+        """
         try:
-            self.repo.get_branch(new_name)
-            raise ValidationError(f"New branch already exists in GitHub: {new_name}")
+            old_ref = self.repo.get_git_ref(f"heads/{old_name}")
         except GithubException as e:
-            if e.status != 404:
-                raise ValidationError(f"GitHub error checkng new branch: {e.data.get("message", str(e))}")
+            if e.status != 404 or not sha:
+                raise ValidationError(f"Failed to create a new branch '{new_name}' (Old branch {old_name} missing): {str(e)}")
+            old_ref = None
+        head = old_ref.object.sha if old_ref else sha
         try:
-            old_branch = self.repo.get_branch(old_name)
-            source_sha = old_branch.commit.sha
-            self.repo.create_git_ref(f"refs/heads/{new_name}", sha=source_sha)
-        except Exception as e:
-            raise ValidationError(
-                f"Failed to create a new branch '{new_name}' (Old branch {old_name} missing): {str(e)}"
-            )
-        self.delete_branch(old_name)
+            self.repo.create_git_ref(f"refs/heads/{new_name}", sha=head)
+        except GithubException as e:
+            if e.status != 422 or "already exists" not in str(e.data).lower():
+                raise ValidationError(f"Failed to create a new branch '{new_name}': {e.data.get('message', str(e))}")
+            # Only a copy made by this row's own interrupted rename may be taken over
+            if not resume or self.repo.get_git_ref(f"heads/{new_name}").object.sha != head:
+                raise ValidationError(f"New branch already exists in GitHub: {new_name}")
+        if old_ref is not None:
+            try:
+                old_ref.delete()
+                logger.info("Deleted GitHub branch: %s", old_name)
+            except GithubException as e:
+                if e.status != 404:
+                    raise ValidationError(f"GitGub deletion error: {e.data.get('message', str(e))}")
+        return self.branch_url(new_name)
 
-        return f"https://github.com/{settings.GITHUB_REPO_NAME}/tree/{new_name}"
+    @instrumented("list_branches")
+    def list_branches(self, prefix=""):
+        """
+        Head SHAs of all branches whose names start with prefix, by branch name.
+        Uses the matching-refs listing, a few paginated calls for the whole repo.
+        """
+        try:
+            return {
+                ref.ref.removeprefix("refs/heads/"): ref.object.sha
+                for ref in self.repo.get_git_matching_refs(f"heads/{prefix}")
+            }
+        except GithubException as e:
+            raise ValidationError(f"GitHub error listing branches: {e.data.get('message', str(e))}")
 
+    @instrumented("delete_branch")
     def delete_branch(self, branch_name):
         try:
             ref = self.repo.get_git_ref(f"heads/{branch_name}")
             ref.delete()
-            print(f"Deleted GitHub branch: {branch_name}")
+            logger.info("Deleted GitHub branch: %s", branch_name)
         except GithubException as e:
             if e.status == 404:
                 pass
             else:
-                raise ValidationError(f"GitGub deletion error: {e.data.get("message", str(e))}")
+                raise ValidationError(f"GitGub deletion error: {e.data.get('message', str(e))}")
+
+
+class GitHubServiceRegistry:
+    """
+    Keeps one GitHubService per worker process, so callers reuse the pooled
+    HTTP session and the repo handle instead of calling get_repo() every time.
+    The repo handle is re-fetched every GITHUB_SERVICE_REFRESH_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._service = None
+        self._loaded_at = 0.0
+        self.repo_lookups = 0
+        self.repo_lookups_avoided = 0
+
+    def get(self):
+        with self._lock:
+            expired = time.monotonic() - self._loaded_at >= settings.GITHUB_SERVICE_REFRESH_INTERVAL
+            if self._service is None or expired:
+                client = self._service.client if self._service else None
+                self._service = GitHubService(client=client)
+                self._loaded_at = time.monotonic()
+                self.repo_lookups += 1
+            else:
+                self.repo_lookups_avoided += 1
+            return self._service
+
+    def reset(self):
+        """Drops the cached service, e.g. after GitHub settings change"""
+        with self._lock:
+            self._service = None
+            self._loaded_at = 0.0
+
+    def stats(self):
+        return {
+            "repo_lookups": self.repo_lookups,
+            "repo_lookups_avoided": self.repo_lookups_avoided,
+        }
+
+
+github_services = GitHubServiceRegistry()
+
+
+def get_github_service():
+    """Returns the shared GitHubService of the current worker process"""
+    return github_services.get()
+
+
+def run_concurrently(func, items, max_workers=None):
+    """
+    Calls func(item) for every item on a bounded thread pool, each in a copy of
+    the caller's context so request metrics see the calls. Threads may share one
+    GitHubService, its connection keeps requests per thread (see github_connection).
+    Returns (item, result, error) tuples in the order of items.
+    """
+    items = list(items)
+    if not items:
+        return []
+    max_workers = min(max_workers or settings.GITHUB_MAX_CONCURRENCY, len(items))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(copy_context().run, func, item) for item in items]
+    results = []
+    for item, future in zip(items, futures):
+        try:
+            results.append((item, future.result(), None))
+        except Exception as e:
+            results.append((item, None, e))
+    return results
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .caching import bump_task_versions
+from .models import BranchesTask, Status, Task, User, UserTask
+from .statuses import status_registry
+from .authentication import user_cache
+from .metrics import record_query
+
+
+@receiver([post_save, post_delete], sender=Task)
+def task_changed(sender, instance, **kwargs):
+    bump_task_versions(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=UserTask)
+@receiver([post_save, post_delete], sender=BranchesTask)
+def task_part_changed(sender, instance, **kwargs):
+    bump_task_versions(instance.task_id)
+
+
+@receiver([post_save, post_delete], sender=Status)
+def status_changed(sender, instance, created=False, **kwargs):
+    status_registry.invalidate()
+    # Tasks carry the status name, statuses in use cannot be deleted
+    if kwargs["signal"] is post_save and not created and settings.TASK_CACHE_ENABLED:
+        bump_task_versions(*Task.objects.filter(status_id=instance.pk).values_list("pk", flat=True))
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    user_cache.invalidate(instance.pk)
+    # Participant lists carry the username, logins only save last_login
+    renamed = update_fields is None or "username" in update_fields
+    if kwargs["signal"] is post_save and not created and renamed and settings.TASK_CACHE_ENABLED:
+        bump_task_versions(*UserTask.objects.filter(user=instance).values_list("task_id", flat=True))
+
+
+@receiver(connection_created)
+def install_query_metrics(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
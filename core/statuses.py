@@ -0,0 +1,56 @@
+import time
+from threading import Lock
+from django.conf import settings
+from .models import Status
+
+# Lookups of unknown names or ids reload the registry at most this often
+MISS_RELOAD_INTERVAL = 1.0
+
+
+class StatusRegistry:
+    """
+    In-process map of status ids and names. Loaded on first use, dropped when a
+    Status is saved or deleted in this process and reloaded after STATUS_REGISTRY_TTL
+    seconds, so changes made by other processes show up as well.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._maps = None
+        self._loaded_at = 0.0
+        self.loads = 0
+
+    def _load(self):
+        names = dict(Status.objects.values_list("id", "name"))
+        maps = (names, {name: pk for pk, name in names.items()})
+        with self._lock:
+            self._maps = maps
+            self._loaded_at = time.monotonic()
+            self.loads += 1
+        return maps
+
+    def _current(self, missing=None):
+        """(names by id, ids by name), reloaded when stale or when a lookup misses"""
+        maps = self._maps
+        if maps is None or time.monotonic() - self._loaded_at >= settings.STATUS_REGISTRY_TTL:
+            return self._load()
+        if missing is not None and missing(maps) and time.monotonic() - self._loaded_at >= MISS_RELOAD_INTERVAL:
+            # Created by another process since the last load
+            return self._load()
+        return maps
+
+    def name(self, status_id):
+        names, _ = self._current(missing=lambda maps: status_id not in maps[0])
+        return names.get(status_id)
+
+    def id(self, name):
+        """Status id by name, None if there is no such status"""
+        _, ids = self._current(missing=lambda maps: name not in maps[1])
+        return ids.get(name)
+
+    def invalidate(self):
+        with self._lock:
+            self._maps = None
+
+
+status_registry = StatusRegistry()
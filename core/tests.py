@@ -1,3 +1,1067 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, resolve, reverse
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed, Throttled, ValidationError
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 
-# Create your tests here.
+from . import github_scheduler as scheduler_module
+from .authentication import StatelessJWTAuthentication, TrackerTokenUser, user_cache
+from .fake_github import FakeGitHubServer
+from .github_connection import ThreadLocalHTTPConnection
+from .github_scheduler import GitHubScheduler
+from .models import BranchesTask, BranchOutbox, GitHubWebhookEvent, Status, Task, User, UserTask, WorkLog
+from .outbox import process_batch
+from .reconcile import diff_branches, reconcile_branches
+from .serializers import RevocableTokenRefreshSerializer, TokenObtainPairWithClaimsSerializer
+from .metrics import GITHUB_CALL_DURATION
+from .services import BranchAlreadyExists, GitHubService, github_services, source_shas
+from .utils import create_branch_name, enqueue_branch_creation
+from .urls import build_urlpatterns
+from .views import AsyncBranchesTaskViewSet, AsyncUserTaskViewSet, TaskViewSet
+from .webhooks import process_events, store_event, verify_signature
+
+
+# Deliveries recorded from a GitHub repository webhook, with a redelivery and a tag event
+RECORDED_DELIVERIES = Path(__file__).parent / "test_data" / "github_webhook_deliveries.ndjson"
+
+
+class FakeGitHubTestCase(TestCase):
+    """Points the GitHub settings at an in-memory FakeGitHubServer for the test"""
+    server_options = {}
+
+    def setUp(self):
+        self.server = FakeGitHubServer("acme/repo", **self.server_options).start()
+        self.addCleanup(self.server.stop)
+        overrides = override_settings(
+            GITHUB_API_URL=self.server.url,
+            GITHUB_ACCESS_TOKEN="test-token",
+            GITHUB_REPO_NAME="acme/repo",
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        github_services.reset()
+        self.addCleanup(github_services.reset)
+        # Quota seen from this server must not hold back requests of later tests
+        self.scheduler = GitHubScheduler()
+        patcher = mock.patch.object(scheduler_module, "github_scheduler", self.scheduler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_branch(self, name):
+        self.server.branches[name] = self.server.branches["main"]
+        return self.server.branches[name]
+
+    def calls_of(self, func, *args, **kwargs):
+        """Result of func and the number of GitHub calls it made"""
+        calls = self.server.calls
+        result = func(*args, **kwargs)
+        return result, self.server.calls - calls
+
+
+class ThreadLocalConnectionTests(FakeGitHubTestCase):
+    def test_threads_sharing_a_connection_get_their_own_responses(self):
+        host, port = self.server.server_address[:2]
+        shared = ThreadLocalHTTPConnection(host, port)
+        names = [f"feature/{index}/shared" for index in range(8)]
+        for name in names:
+            self.add_branch(name)
+        # Every thread sets up its request before any of them reads a response
+        barrier = threading.Barrier(len(names))
+
+        def get_branch(name):
+            shared.request("GET", f"/repos/acme/repo/branches/{name}", None, {})
+            barrier.wait()
+            return json.loads(shared.getresponse().read())["name"]
+
+        with ThreadPoolExecutor(max_workers=len(names)) as executor:
+            self.assertEqual(list(executor.map(get_branch, names)), names)
+
+
+class NativeRenameTests(FakeGitHubTestCase):
+    def test_rename_is_one_call(self):
+        gh_service = GitHubService()
+        sha = self.add_branch("feature/1/old")
+
+        url, calls = self.calls_of(gh_service.rename_branch, "feature/1/old", "feature/1/new")
+
+        self.assertEqual(calls, 1)
+        self.assertEqual(url, "https://github.com/acme/repo/tree/feature/1/new")
+        self.assertEqual(self.server.branches["feature/1/new"], sha)
+        self.assertNotIn("feature/1/old", self.server.branches)
+
+    def test_taken_name_is_an_error_without_fallback(self):
+        gh_service = GitHubService()
+        self.add_branch("feature/1/old")
+        self.add_branch("feature/1/new")
+
+        with self.assertRaises(ValidationError):
+            gh_service.rename_branch("feature/1/old", "feature/1/new", resume=True)
+        self.assertIn("feature/1/old", self.server.branches)
+
+
+class RenameByCopyTests(FakeGitHubTestCase):
+    server_options = {"native_rename": False}
+
+    def test_rename_is_three_calls(self):
+        gh_service = GitHubService()
+        sha = self.add_branch("feature/1/old")
+
+        url, calls = self.calls_of(gh_service.rename_branch, "feature/1/old", "feature/1/new")
+
+        # The rename attempt answered 404, then read, create and delete
+        self.assertEqual(calls, 4)
+        self.assertEqual(url, "https://github.com/acme/repo/tree/feature/1/new")
+        self.assertEqual(self.server.branches["feature/1/new"], sha)
+        self.assertNotIn("feature/1/old", self.server.branches)
+
+    @override_settings(GITHUB_NATIVE_RENAME=False)
+    def test_rename_without_native_attempt_is_three_calls(self):
+        gh_service = GitHubService()
+        self.add_branch("feature/1/old")
+
+        _, calls = self.calls_of(gh_service.rename_branch, "feature/1/old", "feature/1/new")
+
+        self.assertEqual(calls, 3)
+
+    def test_missing_old_branch_is_recreated_from_sha(self):
+        gh_service = GitHubService()
+        sha = self.server.branches["main"]
+
+        gh_service.rename_branch("feature/1/old", "feature/1/new", sha=sha)
+
+        self.assertEqual(self.server.branches["feature/1/new"], sha)
+
+    def test_missing_old_branch_without_sha_is_an_error(self):
+        gh_service = GitHubService()
+
+        with self.assertRaises(ValidationError):
+            gh_service.rename_branch("feature/1/old", "feature/1/new")
+        self.assertNotIn("feature/1/new", self.server.branches)
+
+    def test_taken_name_is_an_error_and_keeps_old_branch(self):
+        gh_service = GitHubService()
+        self.add_branch("feature/1/old")
+        self.add_branch("feature/1/new")
+
+        with self.assertRaises(ValidationError):
+            gh_service.rename_branch("feature/1/old", "feature/1/new")
+        self.assertIn("feature/1/old", self.server.branches)
+        self.assertIn("feature/1/new", self.server.branches)
+
+    def test_resumed_rename_takes_over_its_copy(self):
+        gh_service = GitHubService()
+        self.add_branch("feature/1/old")
+        self.add_branch("feature/1/new")
+
+        gh_service.rename_branch("feature/1/old", "feature/1/new", resume=True)
+
+        self.assertNotIn("feature/1/old", self.server.branches)
+        self.assertIn("feature/1/new", self.server.branches)
+
+
+class ServerErrorTests(FakeGitHubTestCase):
+    """Writes GitHub applied before answering 502 are not sent again"""
+
+    def test_applied_create_is_not_retried(self):
+        gh_service = GitHubService()
+        self.server.fail_after_apply(1)
+        calls = self.server.calls
+
+        with self.assertRaises(ValidationError):
+            gh_service.create_branch("feature/1/new", source_sha=self.server.branches["main"])
+
+        self.assertEqual(self.server.calls - calls, 1)
+        self.assertIn("feature/1/new", self.server.branches)
+        # What the outbox sees on its next attempt
+        with self.assertRaises(BranchAlreadyExists):
+            gh_service.create_branch("feature/1/new", source_sha=self.server.branches["main"])
+
+    def test_applied_rename_is_not_retried_or_copied(self):
+        gh_service = GitHubService()
+        self.add_branch("feature/1/old")
+        self.server.fail_after_apply(1)
+        calls = self.server.calls
+
+        with self.assertRaises(ValidationError):
+            gh_service.rename_branch("feature/1/old", "feature/1/new")
+
+        self.assertEqual(self.server.calls - calls, 1)
+        self.assertIn("feature/1/new", self.server.branches)
+
+
+class OutboxWorkerTests(FakeGitHubTestCase):
+    def setUp(self):
+        super().setUp()
+        # Keep SHAs of other tests' servers out of the shared cache
+        source_shas.invalidate("main")
+        owner = User.objects.create_user("owner", password="secret")
+        executor = User.objects.create_user("executor", password="secret")
+        self.task = Task.objects.create(name="Queued", type=Task.TaskType.FEATURE)
+        self.branches = [
+            enqueue_branch_creation(UserTask.objects.create(user=user, task=self.task, role=role))
+            for user, role in ((owner, UserTask.Role.OWNER), (executor, UserTask.Role.EXECUTOR))
+        ]
+
+    def test_worker_creates_queued_branches(self):
+        output = StringIO()
+        call_command("process_branch_outbox", once=True, stdout=output)
+
+        self.assertIn("2 created, 0 failed", output.getvalue())
+        self.assertFalse(BranchOutbox.objects.exists())
+        for branch in self.branches:
+            branch.refresh_from_db()
+            self.assertEqual(branch.state, BranchesTask.State.ACTIVE)
+            self.assertEqual(branch.url, GitHubService.branch_url(branch.name))
+            self.assertEqual(branch.sha, self.server.branches["main"])
+            self.assertEqual(self.server.branches[branch.name], branch.sha)
+
+    def test_existing_ref_counts_as_created(self):
+        self.add_branch(self.branches[0].name)
+
+        self.assertEqual(process_batch(), (2, 0))
+
+        self.branches[0].refresh_from_db()
+        self.assertEqual(self.branches[0].state, BranchesTask.State.ACTIVE)
+        self.assertIsNone(self.branches[0].sha)
+
+    def test_failed_branch_stays_queued(self):
+        self.server.rate_remaining = 0
+
+        self.assertEqual(process_batch(), (0, 2))
+
+        self.assertEqual(BranchOutbox.objects.filter(attempts=1, last_error__isnull=False).count(), 2)
+        self.assertEqual(
+            set(BranchesTask.objects.values_list("state", flat=True)), {BranchesTask.State.PENDING}
+        )
+
+
+class OutboxThrottleTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user("owner", password="secret")
+        task = Task.objects.create(name="Throttled", type=Task.TaskType.FEATURE)
+        user_task = UserTask.objects.create(user=user, task=task, role=UserTask.Role.OWNER)
+        self.branch = enqueue_branch_creation(user_task)
+
+    def test_throttled_batch_is_rescheduled_without_using_an_attempt(self):
+        with mock.patch("core.outbox.get_github_service"), \
+                mock.patch("core.outbox.create_on_github", side_effect=Throttled(wait=30)):
+            process_batch()
+
+        entry = BranchOutbox.objects.get(branch=self.branch)
+        self.assertEqual(entry.attempts, 0)
+        self.assertGreater(entry.next_attempt_at, timezone.now() + timedelta(seconds=25))
+
+    def test_throttled_branch_is_rescheduled_without_using_an_attempt(self):
+        results = [(self.branch, None, Throttled(wait=30))]
+        with mock.patch("core.outbox.get_github_service"), \
+                mock.patch("core.outbox.create_on_github", return_value=results):
+            self.assertEqual(process_batch(), (0, 1))
+
+        entry = BranchOutbox.objects.get(branch=self.branch)
+        self.assertEqual(entry.attempts, 0)
+        self.assertGreater(entry.next_attempt_at, timezone.now() + timedelta(seconds=25))
+
+
+@override_settings(
+    GITHUB_RATE_LIMIT_PER_SECOND=10,
+    GITHUB_RATE_LIMIT_BURST=2,
+    GITHUB_RATE_LIMIT_RESERVE=0,
+    GITHUB_RATE_LIMIT_BACKOFF=1,
+    GITHUB_RATE_LIMIT_MAX_WAIT=60,
+)
+class GitHubSchedulerTests(TestCase):
+    def setUp(self):
+        self.scheduler = GitHubScheduler()
+
+    def test_bucket_paces_requests_after_the_burst(self):
+        self.assertEqual(self.scheduler.reserve(), 0)
+        self.assertEqual(self.scheduler.reserve(), 0)
+        self.assertAlmostEqual(self.scheduler.reserve(), 0.1, delta=0.01)
+        self.assertAlmostEqual(self.scheduler.reserve(), 0.2, delta=0.01)
+        self.assertEqual(self.scheduler.delayed, 2)
+
+    def test_same_window_only_lowers_the_quota(self):
+        reset = str(int(time.time()) + 600)
+        self.scheduler.update({"x-ratelimit-remaining": "100", "x-ratelimit-reset": reset})
+        self.scheduler.update({"x-ratelimit-remaining": "120", "x-ratelimit-reset": reset})
+        self.assertEqual(self.scheduler.remaining, 100)
+
+        self.scheduler.update({"x-ratelimit-remaining": "4999", "x-ratelimit-reset": str(int(reset) + 3600)})
+        self.assertEqual(self.scheduler.remaining, 4999)
+
+    def test_backoff_follows_retry_after(self):
+        delay = self.scheduler.backoff(0, {"retry-after": "2"})
+        self.assertTrue(2 <= delay <= 3)
+
+    def test_backoff_waits_for_the_reset_of_an_exhausted_quota(self):
+        reset = str(int(time.time()) + 10)
+        delay = self.scheduler.backoff(0, {"x-ratelimit-remaining": "0", "x-ratelimit-reset": reset})
+        self.assertTrue(8 <= delay <= 15)
+
+    def test_backoff_is_exponential_without_hints(self):
+        delay = self.scheduler.backoff(2, {})
+        self.assertTrue(4 <= delay <= 6)
+        self.assertEqual(self.scheduler.retries, 1)
+
+    def test_wait_past_max_wait_is_throttled(self):
+        self.scheduler.update({"x-ratelimit-remaining": "0", "x-ratelimit-reset": str(int(time.time()) + 600)})
+        with self.assertRaises(Throttled) as raised:
+            self.scheduler.reserve()
+        self.assertGreater(raised.exception.wait, 60)
+        self.assertEqual(self.scheduler.rejected, 1)
+
+
+@override_settings(GITHUB_RATE_LIMIT_RESERVE=0, GITHUB_RATE_LIMIT_MAX_WAIT=60)
+class ScheduledGitHubServiceTests(FakeGitHubTestCase):
+    server_options = {"rate_limit": 5}
+
+    def test_secondary_rate_limit_is_retried(self):
+        gh_service = GitHubService()
+        self.server.limit_secondary(2, retry_after=0)
+
+        self.assertEqual(gh_service.list_branches(), {"main": self.server.branches["main"]})
+        self.assertEqual(self.scheduler.retries, 2)
+
+    def test_tracks_the_quota_and_throttles_once_it_is_spent(self):
+        gh_service = GitHubService()
+        self.assertEqual(self.scheduler.remaining, 4)
+        self.assertEqual(self.scheduler.limit, 5)
+
+        self.server.rate_remaining = 0
+        with self.assertRaises(ValidationError):
+            gh_service.list_branches()
+        with self.assertRaises(Throttled):
+            gh_service.list_branches()
+        self.assertEqual(self.scheduler.rejected, 1)
+
+
+@override_settings(TASK_CACHE_ENABLED=True)
+class TaskCacheTestCase(TestCase):
+    """Task reads through cached_task_response, with the cache emptied for every test"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("owner", password="secret")
+        self.status = Status.objects.create(name="open")
+        self.task = Task.objects.create(name="Cached", type=Task.TaskType.FEATURE, status=self.status)
+        self.user_task = UserTask.objects.create(user=self.user, task=self.task, role=UserTask.Role.OWNER)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse("task-detail", args=[self.task.pk])
+
+    def get(self, url=None, etag=None, client=None):
+        headers = {"If-None-Match": etag} if etag else {}
+        return (client or self.client).get(url or self.url, headers=headers)
+
+    def commit(self, func, *args, **kwargs):
+        """Runs a write, then the version bumps waiting for its commit"""
+        with self.captureOnCommitCallbacks(execute=True):
+            func(*args, **kwargs)
+
+
+class TaskCacheTests(TaskCacheTestCase):
+    def test_matching_etag_is_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+
+        not_modified = self.get(etag=f'"other", {response["ETag"]}')
+
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified["ETag"], response["ETag"])
+        self.assertEqual(self.get(etag='"other"').status_code, 200)
+
+    def test_writes_to_the_task_change_the_etag(self):
+        def set_description():
+            self.task.description = "Changed"
+            self.task.save()
+
+        def log_time():
+            self.user_task.work_time = Decimal("2.00")
+            self.user_task.save()
+
+        def add_branch():
+            BranchesTask.objects.create(task=self.task, user_task=self.user_task, name="feature/1/cached", url="url")
+
+        for write in (set_description, log_time, add_branch):
+            with self.subTest(write.__name__):
+                etag = self.get()["ETag"]
+                self.commit(write)
+                response = self.get(etag=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response["ETag"], etag)
+
+    def test_payloads_are_kept_per_user(self):
+        executor = User.objects.create_user("executor", password="secret")
+        self.commit(UserTask.objects.create, user=executor, task=self.task, role=UserTask.Role.EXECUTOR)
+        other = APIClient()
+        other.force_authenticate(executor)
+        owner_response = self.get()
+
+        response = self.get(etag=owner_response["ETag"], client=other)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], owner_response["ETag"])
+        self.assertEqual(response.data["my_role"], UserTask.Role.EXECUTOR)
+        self.assertEqual(self.get().data["my_role"], UserTask.Role.OWNER)
+
+    @override_settings(TASK_CACHE_ENABLED=False)
+    def test_disabled_cache_renders_every_request(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response)
+
+        self.assertEqual(self.get(etag="*").status_code, 200)
+
+
+class TaskCacheInvalidationTests(TaskCacheTestCase):
+    def test_status_rename_changes_the_etag(self):
+        etag = self.get()["ETag"]
+        self.assertEqual(self.get(etag=etag).status_code, 304)
+
+        self.status.name = "in progress"
+        self.commit(self.status.save)
+
+        response = self.get(etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.data["status"], "in progress")
+
+    def test_username_change_changes_the_etag(self):
+        url = reverse("task-users-list", args=[self.task.pk])
+        etag = self.get(url)["ETag"]
+
+        self.user.username = "renamed"
+        self.commit(self.user.save)
+
+        response = self.get(url, etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"][0]["user_name"], "renamed")
+
+    def test_login_keeps_the_etag(self):
+        etag = self.get()["ETag"]
+
+        self.user.last_login = timezone.now()
+        self.commit(self.user.save, update_fields=["last_login"])
+
+        self.assertEqual(self.get(etag=etag).status_code, 304)
+
+
+class TaskQueryCountTests(TestCase):
+    """Reading tasks costs the same number of queries however many tasks and branches there are"""
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", password="secret")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_tasks(self, count, branches=1):
+        tasks = []
+        for _ in range(count):
+            task = Task.objects.create(name="Counted", type=Task.TaskType.FEATURE)
+            user_task = UserTask.objects.create(user=self.user, task=task, role=UserTask.Role.OWNER)
+            BranchesTask.objects.bulk_create([
+                BranchesTask(task=task, user_task=user_task, name=f"feature/{task.pk}/counted-{index}", url="url")
+                for index in range(branches)
+            ])
+            tasks.append(task)
+        return tasks
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_task_list(self):
+        url = reverse("task-list")
+        self.add_tasks(5)
+        self.client.get(url)
+        few = self.count_queries(url)
+
+        self.add_tasks(5)
+        many = self.count_queries(url)
+
+        self.assertEqual(len(self.client.get(url).data["results"]), 10)
+        # Tasks with the caller's role, then their branches
+        self.assertEqual(few, 2)
+        self.assertEqual(many, 2)
+
+    def test_task_retrieve(self):
+        few_branches, = self.add_tasks(1, branches=5)
+        many_branches, = self.add_tasks(1, branches=10)
+        self.client.get(reverse("task-detail", args=[few_branches.pk]))
+
+        few = self.count_queries(reverse("task-detail", args=[few_branches.pk]))
+        many = self.count_queries(reverse("task-detail", args=[many_branches.pk]))
+
+        # The participant check, the task with the caller's role, then its branches
+        self.assertEqual(few, 3)
+        self.assertEqual(many, 3)
+
+
+class TaskPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader", password="secret")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.tasks = [Task.objects.create(name=f"Paged {index}", type=Task.TaskType.FEATURE) for index in range(5)]
+
+    def test_cursor_pages(self):
+        first = self.client.get(reverse("task-list"), {"page_size": 2})
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(set(first.data), {"next", "previous", "results"})
+        self.assertIsNone(first.data["previous"])
+        self.assertEqual([task["id"] for task in first.data["results"]], [task.pk for task in self.tasks[:2]])
+
+        second = self.client.get(first.data["next"])
+        self.assertIsNotNone(second.data["previous"])
+        previous = self.client.get(second.data["previous"])
+        self.assertEqual(previous.data["results"], first.data["results"])
+
+    def test_following_next_lists_every_task_once_in_order(self):
+        ids = []
+        url = reverse("task-list") + "?page_size=2"
+        while url:
+            response = self.client.get(url)
+            ids += [task["id"] for task in response.data["results"]]
+            if len(ids) == 2:
+                # Inserted while paging: no page shifts, the task shows up at the end
+                self.tasks.append(Task.objects.create(name="Late", type=Task.TaskType.FEATURE))
+            url = response.data["next"]
+
+        self.assertEqual(ids, [task.pk for task in self.tasks])
+
+
+class TaskListFilterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("member", password="secret")
+        other = User.objects.create_user("other", password="secret")
+        opened = Status.objects.create(name="open")
+        done = Status.objects.create(name="done")
+        self.owned = self.add_task(self.user, UserTask.Role.OWNER, opened, Task.TaskType.FEATURE)
+        self.executed = self.add_task(self.user, UserTask.Role.EXECUTOR, done, Task.TaskType.BUGFIX)
+        self.foreign = self.add_task(other, UserTask.Role.OWNER, opened, Task.TaskType.FEATURE)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_task(self, user, role, status, task_type):
+        task = Task.objects.create(name="Filtered", status=status, type=task_type)
+        UserTask.objects.create(user=user, task=task, role=role)
+        return task
+
+    def list_ids(self, **params):
+        response = self.client.get(reverse("task-list"), params)
+        self.assertEqual(response.status_code, 200)
+        return [task["id"] for task in response.data["results"]]
+
+    def test_filters(self):
+        cases = [
+            ({}, [self.owned, self.executed, self.foreign]),
+            ({"mine": "1"}, [self.owned, self.executed]),
+            ({"role": "owner"}, [self.owned]),
+            ({"role": "executor"}, [self.executed]),
+            ({"status": "open"}, [self.owned, self.foreign]),
+            ({"status": "unknown"}, []),
+            ({"type": "bugfix"}, [self.executed]),
+            ({"mine": "1", "status": "open"}, [self.owned]),
+        ]
+        for params, tasks in cases:
+            with self.subTest(**params):
+                self.assertEqual(self.list_ids(**params), [task.pk for task in tasks])
+
+    def test_my_role_of_filtered_tasks(self):
+        response = self.client.get(reverse("task-list"), {"role": "executor"})
+        self.assertEqual([task["my_role"] for task in response.data["results"]], [UserTask.Role.EXECUTOR])
+
+    def test_invalid_filters_are_bad_requests(self):
+        for params, field in (({"role": "reviewer"}, "role"), ({"type": "chore"}, "type"), ({"mine": "perhaps"}, "mine")):
+            with self.subTest(**params):
+                response = self.client.get(reverse("task-list"), params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(field, response.data)
+
+
+class ConcurrentWorkTimeTests(TransactionTestCase):
+    """Work time logged at the same time from several workers adds up, no update is lost"""
+
+    def test_concurrent_logs_add_up(self):
+        user = User.objects.create_user("worker", password="secret")
+        task = Task.objects.create(name="Concurrent", type=Task.TaskType.FEATURE)
+        user_task = UserTask.objects.create(user=user, task=task, role=UserTask.Role.OWNER)
+        url = reverse("task-users-log-time", args=[task.pk, user_task.pk])
+
+        def log_time(_):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                return [client.post(url, {"hours": "1.25"}, format="json").status_code for _ in range(5)]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            statuses = [status for statuses in executor.map(log_time, range(8)) for status in statuses]
+
+        self.assertEqual(statuses, [200] * 40)
+        user_task.refresh_from_db()
+        self.assertEqual(user_task.work_time, Decimal("50.00"))
+        self.assertEqual(WorkLog.objects.filter(user_task=user_task).count(), 40)
+
+
+class ParticipantBulkTestMixin:
+    def setUp(self):
+        self.owner = User.objects.create_user("owner", password="secret")
+        self.task = Task.objects.create(name="Team", type=Task.TaskType.FEATURE)
+        UserTask.objects.create(user=self.owner, task=self.task, role=UserTask.Role.OWNER)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def add(self, *participants):
+        return self.client.post(
+            reverse("task-users-bulk", args=[self.task.pk]),
+            {"participants": [{"user_id": user_id, "role": role} for user_id, role in participants]},
+            format="json",
+        )
+
+
+@mock.patch("core.serializers.create_queued_branches")
+class ParticipantBulkTests(ParticipantBulkTestMixin, TestCase):
+    def test_reports_each_item(self, create_queued_branches):
+        alice = User.objects.create_user("alice", password="secret")
+        bob = User.objects.create_user("bob", password="secret")
+
+        response = self.add(
+            (alice.pk, UserTask.Role.EXECUTOR),
+            (0, UserTask.Role.EXECUTOR),
+            (self.owner.pk, UserTask.Role.EXECUTOR),
+            (alice.pk, UserTask.Role.OWNER),
+            (bob.pk, UserTask.Role.EXECUTOR),
+        )
+
+        self.assertEqual(response.status_code, 201)
+        results = response.data["results"]
+        self.assertEqual([result["index"] for result in results], [0, 1, 2, 3, 4])
+        self.assertEqual([result["status"] for result in results], ["added", "invalid", "invalid", "invalid", "added"])
+        self.assertEqual(results[1]["errors"], ["User does not exist"])
+        self.assertEqual(results[2]["errors"], ["User already takes part in the task"])
+        # A user listed twice is added once, with the first role
+        self.assertEqual(results[3]["errors"], ["User already takes part in the task"])
+        self.assertEqual(results[0]["participant"]["user_name"], "alice")
+        self.assertEqual(results[0]["branch"]["state"], BranchesTask.State.PENDING)
+        self.assertEqual(
+            UserTask.objects.get(task=self.task, user=alice).role, UserTask.Role.EXECUTOR
+        )
+        self.assertEqual(BranchOutbox.objects.count(), 2)
+        (branches,), _ = create_queued_branches.call_args
+        self.assertEqual({branch.user_task.user_id for branch in branches}, {alice.pk, bob.pk})
+
+    def test_nothing_added_is_a_bad_request(self, create_queued_branches):
+        response = self.add((0, UserTask.Role.EXECUTOR), (self.owner.pk, UserTask.Role.EXECUTOR))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result["status"] for result in response.data["results"]], ["invalid", "invalid"])
+        self.assertEqual(UserTask.objects.filter(task=self.task).count(), 1)
+        create_queued_branches.assert_called_once_with([])
+
+    def test_only_the_owner_adds_participants(self, create_queued_branches):
+        alice = User.objects.create_user("alice", password="secret")
+        self.client.force_authenticate(alice)
+
+        self.assertEqual(self.add((alice.pk, UserTask.Role.EXECUTOR)).status_code, 403)
+
+
+class ParticipantBulkCommitTests(ParticipantBulkTestMixin, TransactionTestCase):
+    def test_branches_are_created_after_the_commit(self):
+        alice = User.objects.create_user("alice", password="secret")
+        seen = []
+
+        def create_queued_branches(branches):
+            seen.append((connection.in_atomic_block, UserTask.objects.filter(user=alice).exists()))
+            return branches
+
+        with mock.patch("core.serializers.create_queued_branches", side_effect=create_queued_branches):
+            self.assertEqual(self.add((alice.pk, UserTask.Role.EXECUTOR)).status_code, 201)
+
+        self.assertEqual(seen, [(False, True)])
+
+
+@override_settings(JWT_STATELESS_AUTH=True)
+class StatelessAuthenticationTests(TestCase):
+    """Settings of JWT_STATELESS_AUTH=True, views authenticate with StatelessJWTAuthentication"""
+
+    def setUp(self):
+        # Set up by the settings module, which has already been imported
+        patcher = mock.patch.object(jwt_settings, "CHECK_REVOKE_TOKEN", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user("member", password="secret")
+        self.addCleanup(user_cache.invalidate, self.user.pk)
+        self.list_tasks = TaskViewSet.as_view({"get": "list"}, authentication_classes=[StatelessJWTAuthentication])
+        self.export_tasks = TaskViewSet.as_view({"get": "export"}, authentication_classes=[StatelessJWTAuthentication])
+
+    def request(self, view, token):
+        request = APIRequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        return view(request)
+
+    def token(self):
+        return TokenObtainPairWithClaimsSerializer.get_token(self.user)
+
+    def test_token_user_comes_from_claims(self):
+        access = self.token().access_token
+        user, _ = StatelessJWTAuthentication().authenticate(
+            APIRequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {access}")
+        )
+
+        self.assertIsInstance(user, TrackerTokenUser)
+        self.assertEqual((user.id, user.username), (self.user.pk, "member"))
+        self.assertEqual(self.request(self.list_tasks, access).status_code, 200)
+
+    def test_inactive_user_is_rejected(self):
+        access = self.token().access_token
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.request(self.list_tasks, access).status_code, 401)
+
+    def test_token_issued_before_a_password_change_is_rejected(self):
+        access = self.token().access_token
+        self.assertEqual(self.request(self.list_tasks, access).status_code, 200)
+
+        self.user.set_password("changed")
+        self.user.save()
+
+        response = self.request(self.list_tasks, access)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data["code"], "password_changed")
+        self.assertEqual(self.request(self.list_tasks, self.token().access_token).status_code, 200)
+
+    def test_staff_flag_comes_from_the_user_row(self):
+        access = self.token().access_token
+        self.assertEqual(self.request(self.export_tasks, access).status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+
+        self.assertEqual(self.request(self.export_tasks, access).status_code, 200)
+
+    def test_refresh_is_checked_against_the_stored_password(self):
+        refresh = str(self.token())
+        serializer = RevocableTokenRefreshSerializer(data={"refresh": refresh})
+        self.assertTrue(serializer.is_valid())
+        self.assertIn("access", serializer.validated_data)
+
+        # Changed through another worker: this process still has the old row cached
+        user_cache.get(self.user.pk)
+        User.objects.filter(pk=self.user.pk).update(password="changed-elsewhere")
+
+        with self.assertRaises(AuthenticationFailed):
+            RevocableTokenRefreshSerializer(data={"refresh": refresh}).is_valid()
+
+
+class AsyncGitHubUrls:
+    """URLconf of GITHUB_ASYNC_VIEWS=True"""
+    urlpatterns = [path("api/", include(build_urlpatterns(async_github_views=True)))]
+
+
+@override_settings(GITHUB_ASYNC_VIEWS=True, ROOT_URLCONF=AsyncGitHubUrls)
+class AsyncViewsTests(FakeGitHubTestCase):
+    def setUp(self):
+        super().setUp()
+        source_shas.invalidate("main")
+        self.owner = User.objects.create_user("owner", password="secret")
+        self.task = Task.objects.create(name="Async", type=Task.TaskType.FEATURE)
+        UserTask.objects.create(user=self.owner, task=self.task, role=UserTask.Role.OWNER)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_async_viewsets_are_routed(self):
+        self.assertIs(resolve(reverse("task-branches-list", args=[1])).func.cls, AsyncBranchesTaskViewSet)
+        self.assertIs(resolve(reverse("task-users-bulk", args=[1])).func.cls, AsyncUserTaskViewSet)
+
+    def test_branch_create_rename_and_delete(self):
+        response = self.client.post(
+            reverse("task-branches-list", args=[self.task.pk]), {"name": "feature/1/manual"}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["sha"], self.server.branches["main"])
+        self.assertIn("feature/1/manual", self.server.branches)
+        url = reverse("task-branches-detail", args=[self.task.pk, response.data["id"]])
+
+        response = self.client.patch(url, {"name": "feature/1/renamed"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["url"], GitHubService.branch_url("feature/1/renamed"))
+        self.assertIn("feature/1/renamed", self.server.branches)
+        self.assertNotIn("feature/1/manual", self.server.branches)
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertNotIn("feature/1/renamed", self.server.branches)
+        self.assertFalse(BranchesTask.objects.filter(task=self.task).exists())
+
+    def test_participants_get_their_branches_right_away(self):
+        alice = User.objects.create_user("alice", password="secret")
+        bob = User.objects.create_user("bob", password="secret")
+
+        response = self.client.post(
+            reverse("task-users-bulk", args=[self.task.pk]),
+            {"participants": [{"user_id": alice.pk, "role": "executor"}, {"user_id": 0, "role": "executor"}]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([result["status"] for result in response.data["results"]], ["added", "invalid"])
+
+        response = self.client.post(
+            reverse("task-users-list", args=[self.task.pk]), {"user": bob.pk, "role": "executor"}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+
+        branches = BranchesTask.objects.filter(user_task__user__in=[alice, bob])
+        self.assertEqual({branch.state for branch in branches}, {BranchesTask.State.ACTIVE})
+        self.assertTrue(all(branch.name in self.server.branches for branch in branches))
+        self.assertFalse(BranchOutbox.objects.exists())
+
+
+class TaskRenameTests(FakeGitHubTestCase):
+    def test_renamed_branch_is_active_again(self):
+        user = User.objects.create_user("owner", password="secret")
+        task = Task.objects.create(name="Before", type=Task.TaskType.FEATURE)
+        user_task = UserTask.objects.create(user=user, task=task, role=UserTask.Role.OWNER)
+        old_name = create_branch_name(task, user_task)
+        sha = self.add_branch(old_name)
+        # A webhook saw the old name go away while the rename was in flight
+        branch = BranchesTask.objects.create(
+            task=task, user_task=user_task, name=old_name, url=None, sha=sha, state=BranchesTask.State.DELETED
+        )
+
+        task.name = "After"
+        task.save()
+
+        branch.refresh_from_db()
+        self.assertEqual(branch.name, create_branch_name(task, user_task))
+        self.assertEqual(branch.state, BranchesTask.State.ACTIVE)
+        self.assertEqual(branch.url, GitHubService.branch_url(branch.name))
+        self.assertIsNone(branch.renaming_to)
+        self.assertIn(branch.name, self.server.branches)
+
+    def add_participant(self):
+        user = User.objects.create_user("owner", password="secret")
+        task = Task.objects.create(name="Before", type=Task.TaskType.FEATURE)
+        user_task = UserTask.objects.create(user=user, task=task, role=UserTask.Role.OWNER)
+        BranchesTask.objects.create(
+            task=task, user_task=user_task, name=create_branch_name(task, user_task), url="url"
+        )
+        return task
+
+    def test_unavailable_github_leaves_the_rows(self):
+        task = self.add_participant()
+        old_name = BranchesTask.objects.get(task=task).name
+        task.name = "After"
+
+        with mock.patch("core.utils.get_github_service", side_effect=ValidationError("down")), \
+                self.assertLogs("core.utils", "ERROR") as logs:
+            task.save()
+
+        self.assertIn("GitHub service init failed", logs.output[0])
+        self.assertEqual(BranchesTask.objects.get(task=task).name, old_name)
+
+    def test_database_errors_are_not_reported_as_github_errors(self):
+        task = self.add_participant()
+        task.name = "After"
+
+        with mock.patch("core.utils.mark_branch_renames", side_effect=DatabaseError("gone")), \
+                self.assertRaises(DatabaseError):
+            task.save()
+
+
+@override_settings(GITHUB_REPO_NAME="acme/repo")
+class WebhookRenameTests(TestCase):
+    def test_delete_of_a_branch_being_renamed_is_ignored(self):
+        branch = BranchesTask.objects.create(
+            name="feature/1/old", url="url", renaming_to="feature/1/new", state=BranchesTask.State.ACTIVE
+        )
+        store_event("delivery-1", "delete", {
+            "ref": "feature/1/old", "ref_type": "branch", "repository": {"full_name": "acme/repo"},
+        })
+
+        self.assertEqual(process_events(), (1, 0))
+        branch.refresh_from_db()
+        self.assertEqual(branch.state, BranchesTask.State.ACTIVE)
+
+
+@override_settings(GITHUB_REPO_NAME="acme/repo", GITHUB_WEBHOOK_SECRET="webhook-secret")
+class WebhookTests(TestCase):
+    def sign(self, body, secret="webhook-secret"):
+        return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+    def deliver(self, body, signature):
+        return self.client.post(
+            reverse("github-webhook"), body, content_type="application/json",
+            headers={"X-GitHub-Event": "create", "X-GitHub-Delivery": "delivery-1", "X-Hub-Signature-256": signature},
+        )
+
+    def test_signature(self):
+        body = b'{"ref": "feature/1/a"}'
+        self.assertTrue(verify_signature(body, self.sign(body)))
+        self.assertFalse(verify_signature(body, self.sign(body, secret="other-secret")))
+        self.assertFalse(verify_signature(body + b" ", self.sign(body)))
+        self.assertFalse(verify_signature(body, None))
+
+    def test_signed_delivery_is_stored(self):
+        with RECORDED_DELIVERIES.open() as recorded:
+            body = json.dumps(json.loads(recorded.readline())["payload"]).encode()
+
+        response = self.deliver(body, self.sign(body))
+
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(GitHubWebhookEvent.objects.filter(delivery_id="delivery-1", exists=True).exists())
+
+    def test_bad_signature_is_forbidden(self):
+        body = b'{"ref": "feature/1/a"}'
+        response = self.deliver(body, self.sign(body, secret="other-secret"))
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(GitHubWebhookEvent.objects.exists())
+
+    @override_settings(GITHUB_WEBHOOK_SECRET="")
+    def test_endpoint_is_hidden_without_a_secret(self):
+        body = b'{"ref": "feature/1/a"}'
+        self.assertEqual(self.deliver(body, self.sign(body)).status_code, 404)
+
+    def test_redeliveries_are_dropped(self):
+        call_command("process_webhook_events", file=str(RECORDED_DELIVERIES), once=True, stdout=mock.Mock())
+        # The push redelivered with the same id and the tag are not stored
+        self.assertEqual(GitHubWebhookEvent.objects.count(), 5)
+
+        with RECORDED_DELIVERIES.open() as recorded:
+            for line in recorded:
+                delivery = json.loads(line)
+                self.assertFalse(store_event(delivery["delivery"], delivery["event"], delivery["payload"]))
+        self.assertEqual(GitHubWebhookEvent.objects.count(), 5)
+
+    def test_events_of_a_branch_are_coalesced(self):
+        created = BranchesTask.objects.create(name="feature/1/login-form-alice-owner", state=BranchesTask.State.DELETED)
+        deleted = BranchesTask.objects.create(
+            name="bugfix/2/null-status-bob-executor", url="url", sha="b7a1f9c27caa4e03c14a88feb56e2d4f7de6a4c5"
+        )
+        with RECORDED_DELIVERIES.open() as recorded:
+            for line in recorded:
+                delivery = json.loads(line)
+                store_event(delivery["delivery"], delivery["event"], delivery["payload"])
+
+        self.assertEqual(process_events(), (5, 2))
+        self.assertEqual(process_events(), (0, 0))
+
+        created.refresh_from_db()
+        self.assertEqual(created.state, BranchesTask.State.ACTIVE)
+        self.assertEqual(created.url, GitHubService.branch_url(created.name))
+        # The last push wins
+        self.assertEqual(created.sha, "7638417db6d59f3c431d3e1f261cc637155684cd")
+        deleted.refresh_from_db()
+        self.assertEqual((deleted.state, deleted.url, deleted.sha), (BranchesTask.State.DELETED, None, None))
+
+
+class ReconcileRenameTests(TestCase):
+    def test_branch_being_renamed_is_left_to_the_rename(self):
+        task = Task.objects.create(name="Renaming", type=Task.TaskType.FEATURE)
+        row = BranchesTask.objects.create(task=task, name="feature/1/old", url="url", renaming_to="feature/1/new")
+
+        missing, to_fix, orphan_refs, unowned_refs, _ = diff_branches(
+            {"feature/1/new": "sha"}, [row], GitHubService.branch_url
+        )
+
+        self.assertEqual((missing, to_fix, orphan_refs, unowned_refs), ([], [], [], []))
+
+
+class ReconcileTests(FakeGitHubTestCase):
+    def test_only_branches_of_deleted_tasks_are_deleted(self):
+        task = Task.objects.create(name="Kept", type=Task.TaskType.FEATURE)
+        kept = BranchesTask.objects.create(task=task, name="feature/1/kept", url="url")
+        self.add_branch(kept.name)
+        orphan = BranchesTask.objects.create(task=None, name="feature/2/deleted-task", url="url")
+        self.add_branch(orphan.name)
+        self.add_branch("feature/3/made-by-hand")
+
+        result = reconcile_branches()
+
+        self.assertEqual(result["deleted"], ["feature/2/deleted-task"])
+        self.assertEqual(result["unowned"], ["feature/3/made-by-hand"])
+        self.assertEqual(set(self.server.branches), {"main", "feature/1/kept", "feature/3/made-by-hand"})
+        self.assertFalse(BranchesTask.objects.filter(pk=orphan.pk).exists())
+        kept.refresh_from_db()
+        self.assertEqual((kept.state, kept.sha), (BranchesTask.State.ACTIVE, self.server.branches[kept.name]))
+
+    def test_dry_run_changes_nothing(self):
+        orphan = BranchesTask.objects.create(task=None, name="feature/2/deleted-task", url="url")
+        self.add_branch(orphan.name)
+
+        output = StringIO()
+        call_command("reconcile_branches", dry_run=True, stdout=output)
+
+        self.assertIn("To be deleted from GitHub: 1", output.getvalue())
+        self.assertIn(orphan.name, self.server.branches)
+        self.assertTrue(BranchesTask.objects.filter(pk=orphan.pk).exists())
+
+
+class MetricsEndpointTests(TestCase):
+    @override_settings(METRICS_TOKEN="")
+    def test_hidden_without_a_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 404)
+
+    @override_settings(METRICS_TOKEN="scrape-token")
+    def test_needs_the_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        response = self.client.get(reverse("metrics"), headers={"Authorization": "Bearer scrape-token"})
+        self.assertEqual(response.status_code, 200)
+
+
+class SourceShaMetricsTests(FakeGitHubTestCase):
+    def github_calls(self):
+        return GITHUB_CALL_DURATION._series.get(("get_source_sha", "ok"), {"count": 0})["count"]
+
+    def test_cache_hits_are_not_timed_as_github_calls(self):
+        gh_service = GitHubService()
+        source_shas.invalidate("main")
+        self.addCleanup(source_shas.invalidate, "main")
+        timed = self.github_calls()
+
+        _, calls = self.calls_of(gh_service.get_source_sha)
+        self.assertEqual(calls, 1)
+        _, calls = self.calls_of(gh_service.get_source_sha)
+        self.assertEqual(calls, 0)
+
+        self.assertEqual(self.github_calls() - timed, 1)
+
+
+class TaskBulkCreateTests(TestCase):
+    def test_reports_each_item(self):
+        user = User.objects.create_user("importer", password="secret")
+        client = APIClient()
+        client.force_authenticate(user)
+        Status.objects.create(name="open")
+        tasks = [{"name": f"Imported {index}", "status": "open", "type": "feature"} for index in range(3)]
+        tasks.insert(1, {"name": "Broken", "status": "open", "type": "unknown"})
+
+        response = client.post(reverse("task-bulk"), {"tasks": tasks}, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        results = response.data["results"]
+        self.assertEqual([result["status"] for result in results], ["created", "invalid", "created", "created"])
+        self.assertIn("type", results[1]["errors"])
+        created = results[2]["task"]
+        self.assertEqual(created["my_role"], UserTask.Role.OWNER)
+        self.assertEqual([branch["state"] for branch in created["branches"]], [BranchesTask.State.PENDING])
+        self.assertEqual(BranchOutbox.objects.count(), 3)
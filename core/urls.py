@@ -1,18 +1,32 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework_nested import routers 
-from .views import RegisterView, TaskViewSet, UserTaskViewSet, BranchesTaskViewSet, ChangePasswordView
+from .views import RegisterView, TaskViewSet, UserTaskViewSet, AsyncUserTaskViewSet, BranchesTaskViewSet, AsyncBranchesTaskViewSet, ChangePasswordView, WorkTimeReportView, RefreshWorkTimeReportView, GitHubRateLimitView
 
-router = routers.SimpleRouter()
-router.register(r'tasks', TaskViewSet, basename='task')
-users_task_router = routers.NestedSimpleRouter(router, r'tasks', lookup='task')
-users_task_router.register(r'users', UserTaskViewSet, basename='task-users')
-branches_task_router = routers.NestedSimpleRouter(router, r"tasks", lookup='task')
-branches_task_router.register(r"branches", BranchesTaskViewSet, basename="task-branches")
 
-urlpatterns = [
-    path('', include(router.urls)),
-    path('', include(users_task_router.urls)),
-    path('', include(branches_task_router.urls)),    
-    path("register/", RegisterView.as_view(), name='register'),
-    path("change-password/", ChangePasswordView.as_view(), name="change-password"),
-]
\ No newline at end of file
+def build_urlpatterns(async_github_views=settings.GITHUB_ASYNC_VIEWS):
+    """API routes, participants and branches use the async viewsets when async_github_views is set"""
+    router = routers.SimpleRouter()
+    router.register(r'tasks', TaskViewSet, basename='task')
+    users_task_router = routers.NestedSimpleRouter(router, r'tasks', lookup='task')
+    users_task_router.register(
+        r'users', AsyncUserTaskViewSet if async_github_views else UserTaskViewSet, basename='task-users'
+    )
+    branches_task_router = routers.NestedSimpleRouter(router, r"tasks", lookup='task')
+    branches_task_router.register(
+        r"branches", AsyncBranchesTaskViewSet if async_github_views else BranchesTaskViewSet, basename="task-branches"
+    )
+
+    return [
+        path('', include(router.urls)),
+        path('', include(users_task_router.urls)),
+        path('', include(branches_task_router.urls)),    
+        path("register/", RegisterView.as_view(), name='register'),
+        path("change-password/", ChangePasswordView.as_view(), name="change-password"),
+        path("reports/work-time/", WorkTimeReportView.as_view(), name="work-time-report"),
+        path("reports/work-time/refresh/", RefreshWorkTimeReportView.as_view(), name="work-time-report-refresh"),
+        path("github/rate-limit/", GitHubRateLimitView.as_view(), name="github-rate-limit"),
+    ]
+
+
+urlpatterns = build_urlpatterns()
@@ -1,53 +1,120 @@
-from github import Github, GithubException
-from .services import GitHubService
+import logging
+from .services import get_github_service, run_concurrently
+from .caching import bump_task_versions
 from django.conf import settings
+from django.utils import timezone
 from rest_framework.exceptions import ValidationError
 
+logger = logging.getLogger(__name__)
 
-def create_branch_and_task_record(user_task):
-    from .models import BranchesTask
+
+def enqueue_branch_creation(user_task):
+    """
+    Records the participant branch as pending and queues its creation in the outbox.
+    Must run in the same transaction as the UserTask row, GitHub is called by the worker.
+    """
+    from .models import BranchesTask, BranchOutbox
     task = user_task.task
     branch_name = create_branch_name(task, user_task)
 
-    try:
-        gh_service = GitHubService()
-        
-        branch_url = gh_service.create_branch(branch_name)
-        branch_task, created = BranchesTask.objects.update_or_create(
+    branch_task, created = BranchesTask.objects.update_or_create(
+        user_task=user_task,
+        defaults={
+            "url": None,
+            "task": task,
+            "name": branch_name,
+            "state": BranchesTask.State.PENDING,
+        }
+    )
+    BranchOutbox.objects.update_or_create(
+        branch=branch_task,
+        defaults={
+            "attempts": 0,
+            "next_attempt_at": timezone.now(),
+            "last_error": None,
+        }
+    )
+    return branch_task
+
+
+def enqueue_branch_creations(user_tasks):
+    """Batch version of enqueue_branch_creation for participants that have no branch yet"""
+    from .models import BranchesTask, BranchOutbox
+    branches = BranchesTask.objects.bulk_create([
+        BranchesTask(
             user_task=user_task,
-            defaults={
-                "url": branch_url,
-                "task": task,
-                "name": branch_name
-            }
+            task=user_task.task,
+            name=create_branch_name(user_task.task, user_task),
+            state=BranchesTask.State.PENDING,
         )
-        print(f"BranchTask record {'created' if created else 'updated'} for branch: {branch_name}")
-        return branch_task
-    except ValidationError as e:
-        print(f"Validation error creating branch: {branch_name}")
-        return None
-    except Exception as e:
-        print(f"Error creating branch {branch_name} - {str(e)}")
-        return None
+        for user_task in user_tasks
+    ])
+    BranchOutbox.objects.bulk_create([BranchOutbox(branch=branch) for branch in branches])
+    bump_task_versions(*{branch.task_id for branch in branches})
+    return branches
+
+
+def bulk_create_tasks(tasks_data, user):
+    """
+    Inserts tasks with bulk_create, makes the user owner of each of them
+    and queues their branches. Must run inside a transaction.
+    """
+    from .models import Task, UserTask
+    tasks = [Task(**data) for data in tasks_data]
+    if not tasks:
+        return []
+    reserved_ids = Task.objects.reserve_ids(len(tasks))
+    for task, pk in zip(tasks, reserved_ids):
+        task.pk = pk
+        task.slug = task.build_slug()
+    Task.objects.bulk_create(tasks)
+    if not reserved_ids:
+        for task in tasks:
+            task.slug = task.build_slug()
+        Task.objects.bulk_update(tasks, ["slug"])
+
+    user_tasks = UserTask.objects.bulk_create([
+        UserTask(user=user, task=task, role=UserTask.Role.OWNER) for task in tasks
+    ])
+    enqueue_branch_creations(user_tasks)
+    return tasks
     
 
+def mark_branch_renames(renames):
+    """
+    Records the new name of each (branch, new_name) rename before GitHub is called, so
+    webhook deletes of the old name are not applied meanwhile and a retry after an
+    interruption can take over the copy it left. Returns, by branch pk, whether the
+    branch already was being renamed to the same name.
+    """
+    from .models import BranchesTask
+    resumed = {}
+    for branch, new_name in renames:
+        resumed[branch.pk] = branch.renaming_to == new_name
+        branch.renaming_to = new_name
+    if renames:
+        BranchesTask.objects.bulk_update([branch for branch, _ in renames], ["renaming_to"])
+    return resumed
+
+
 def update_branches_for_task(task, old_slug, old_type):
     """
     Recreates branches for all participants if task details (slug, type) changed.
-    old_task_data: A dictionary containing the old values of the task fields.
+    Renames run concurrently on GitHub, the resulting rows are written in one batch.
+    Branches still waiting in the outbox are only renamed in the database.
     """
     from .models import UserTask, BranchesTask
     if task.slug == old_slug and task.type == old_type:
         return 
 
-    try:
-        gh_service = GitHubService()
-    except Exception as e:
-        print(f"GitHub service init failed: {e}")
-        return
-
     user_tasks = UserTask.objects.filter(task=task).select_related('user')
+    branches = {
+        branch.user_task_id: branch
+        for branch in BranchesTask.objects.filter(user_task__task=task)
+    }
 
+    renames = []
+    pending = []
     for user_task in user_tasks:
         old_branch_name = create_branch_name(
             task, user_task, custom_slug=old_slug, custom_type=old_type
@@ -55,21 +122,75 @@ def update_branches_for_task(task, old_slug, old_type):
         new_branch_name = create_branch_name(task, user_task)
         if old_branch_name == new_branch_name:
             continue
+        branch = branches.get(user_task.pk)
+        if branch and branch.state == BranchesTask.State.PENDING:
+            branch.name = new_branch_name
+            pending.append(branch)
+        else:
+            renames.append((user_task, old_branch_name, new_branch_name))
+
+    gh_service = None
+    if renames:
         try:
-            new_branch_url = gh_service.rename_branch(old_branch_name, new_branch_name)
-            BranchesTask.objects.update_or_create(
-                user_task=user_task,
-                defaults={
-                    "name": new_branch_name,
-                    "url": new_branch_url,
-                    "task": task
-                }
-            )
-            print(f"Branch in database updated: {old_branch_name} -> {new_branch_name}")          
-        except ValidationError as e:
-            print(f"GitHub rename failed: {e}")    
+            gh_service = get_github_service()
         except Exception as e:
-            print(f"Unexpected error: {e}")
+            logger.error("GitHub service init failed: %s", e)
+
+    results = []
+    if gh_service is not None:
+        resumed = mark_branch_renames([
+            (branches[user_task.pk], new_branch_name)
+            for user_task, _, new_branch_name in renames if user_task.pk in branches
+        ])
+
+        def rename(item):
+            user_task, old_branch_name, new_branch_name = item
+            branch = branches.get(user_task.pk)
+            if branch is None:
+                return gh_service.rename_branch(old_branch_name, new_branch_name)
+            return gh_service.rename_branch(
+                old_branch_name, new_branch_name, sha=branch.sha, resume=resumed[branch.pk]
+            )
+
+        # Errors of single renames come back in the results, other errors propagate
+        results = run_concurrently(rename, renames)
+
+    renamed = []
+    to_create = []
+    failed = []
+    for (user_task, old_branch_name, new_branch_name), new_branch_url, error in results:
+        branch = branches.get(user_task.pk)
+        if error:
+            logger.error("GitHub rename failed: %s -> %s: %s", old_branch_name, new_branch_name, error)
+            if branch is not None:
+                branch.renaming_to = None
+                failed.append(branch)
+            continue
+        if branch is None:
+            to_create.append(BranchesTask(
+                user_task=user_task, task=task, name=new_branch_name, url=new_branch_url
+            ))
+            continue
+        branch.name = new_branch_name
+        branch.url = new_branch_url
+        branch.task = task
+        branch.state = BranchesTask.State.ACTIVE
+        branch.renaming_to = None
+        renamed.append(branch)
+
+    if renamed:
+        # The branch exists under its new name, whatever a webhook said about the old one
+        BranchesTask.objects.bulk_update(renamed, ["name", "url", "task", "state", "renaming_to"])
+    if pending:
+        BranchesTask.objects.bulk_update(pending, ["name", "task"])
+    if failed:
+        BranchesTask.objects.bulk_update(failed, ["renaming_to"])
+    if to_create:
+        BranchesTask.objects.bulk_create(to_create)
+    bump_task_versions(task.pk)
+    logger.info(
+        "Branches in database updated for task %s: %s", task.pk, len(renamed) + len(pending) + len(to_create)
+    )
 
 
 def create_branch_name(task, user_task, custom_slug=None, custom_type=None):
@@ -1,3 +1,11 @@
+import hmac
+import json
+from adrf.viewsets import GenericViewSet as AsyncGenericViewSet
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.shortcuts import render
 from rest_framework import generics, permissions, viewsets, status
 from rest_framework.decorators import action
@@ -5,9 +13,19 @@ from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
 from django.db import transaction
 from .models import User, Task, UserTask, BranchesTask
-from .serializers import UserSerializer, TaskSerializer, LogWorkTimeSerializer, UserTaskSerializer, BranchesTaskSerializer, ChangePasswordSerializer
+from .serializers import UserSerializer, TaskSerializer, TaskBulkCreateSerializer, LogWorkTimeSerializer, UserTaskSerializer, UserTaskBulkCreateSerializer, BranchesTaskSerializer, ChangePasswordSerializer, TaskListQuerySerializer, WorkTimeReportQuerySerializer
 from .permissions import IsTaskOwner, IsSelf, IsParticipantOfTask
-from .services import GitHubService
+from .services import get_github_service
+from .async_github import get_async_github_service
+from .outbox import acreate_queued_branches
+from .statuses import status_registry
+from .reports import refresh_work_time_reports, work_time_report
+from .caching import cached_task_response
+from .exports import EXPORT_FORMATS, stream_export
+from .utils import mark_branch_renames
+from .webhooks import store_event, verify_signature
+from .github_scheduler import github_scheduler
+from . import metrics
 
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
@@ -15,7 +33,7 @@ class RegisterView(generics.CreateAPIView):
     serializer_class = UserSerializer
 
 class TaskViewSet(viewsets.ModelViewSet):
-    queryset = Task.objects.all()
+    queryset = Task.objects.prefetch_related("branchestask_set")
     serializer_class = TaskSerializer
     base_permission_classes = [permissions.IsAuthenticated]
 
@@ -25,7 +43,65 @@ class TaskViewSet(viewsets.ModelViewSet):
             permission_classes.append(IsTaskOwner)
         elif self.action == 'retrieve':
             permission_classes.append(IsParticipantOfTask)
+        elif self.action == 'export':
+            permission_classes.append(permissions.IsAdminUser)
         return [permission() for permission in permission_classes] 
+
+    def get_serializer_class(self):
+        if self.action == "bulk":
+            return TaskBulkCreateSerializer
+        return TaskSerializer
+
+    def get_queryset(self):
+        """
+        Every task carries the caller's role as my_role. The list can be narrowed with
+        ?mine=1, ?role=owner|executor (implies mine), ?status=<name> and ?type=<type>.
+        """
+        queryset = super().get_queryset()
+        user_id = self.request.user.id
+        if self.action != "list":
+            return queryset.with_role_of(user_id)
+
+        query = TaskListQuerySerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        filters = query.validated_data
+        if "status" in filters:
+            status_id = status_registry.id(filters["status"])
+            if status_id is None:
+                return queryset.none()
+            queryset = queryset.filter(status_id=status_id)
+        if "type" in filters:
+            queryset = queryset.filter(type=filters["type"])
+        if filters["mine"] or "role" in filters:
+            return queryset.participated_by(user_id, role=filters.get("role"))
+        return queryset.with_role_of(user_id)
+
+    def retrieve(self, request, *args, **kwargs):
+        return cached_task_response(request, self.kwargs['pk'], super().retrieve, *args, **kwargs)
+
+    @action(detail=False, methods=["get"], name="Export tasks with logged time")
+    def export(self, request):
+        """Streams every task participant with logged time, ?export_format=csv|ndjson"""
+        export_format = request.query_params.get("export_format", "csv")
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({"export_format": f"Choose one of: {', '.join(EXPORT_FORMATS)}"})
+        response = StreamingHttpResponse(
+            stream_export(export_format, settings.EXPORT_CHUNK_SIZE),
+            content_type=EXPORT_FORMATS[export_format]
+        )
+        response["Content-Disposition"] = f'attachment; filename="tasks.{export_format}"'
+        return response
+
+    @action(detail=False, methods=["post"], name="Bulk create tasks")
+    def bulk(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+        created = any(result["status"] == "created" for result in results)
+        return Response(
+            {"results": results},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST
+        )
     
 class BranchesTaskViewSet(viewsets.ModelViewSet):
     serializer_class = BranchesTaskSerializer
@@ -35,13 +111,63 @@ class BranchesTaskViewSet(viewsets.ModelViewSet):
         if getattr(self, 'swagger_fake_view', False):
             return BranchesTask.objects.none()
         return BranchesTask.objects.filter(task_id=self.kwargs['task_pk'])
+
+    def list(self, request, *args, **kwargs):
+        return cached_task_response(request, self.kwargs['task_pk'], super().list, *args, **kwargs)
     
     def perform_destroy(self, instance):
         branch_name = instance.name
-        gh_service = GitHubService()
+        gh_service = get_github_service()
         gh_service.delete_branch(branch_name)
         instance.delete()
 
+class AsyncBranchesTaskViewSet(AsyncGenericViewSet, BranchesTaskViewSet):
+    """
+    BranchesTaskViewSet with GitHub-bound actions as coroutines, so waiting on GitHub
+    does not hold a worker thread under ASGI. Enabled by GITHUB_ASYNC_VIEWS.
+    """
+
+    async def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        branch_name = serializer.validated_data["name"]
+        branch_url, sha = await get_async_github_service().create_branch(branch_name)
+        branch = await BranchesTask.objects.acreate(
+            task_id=int(self.kwargs["task_pk"]), name=branch_name, url=branch_url, sha=sha
+        )
+        return Response(self.get_serializer(branch).data, status=status.HTTP_201_CREATED)
+
+    async def update(self, request, *args, **kwargs):
+        partial = kwargs.pop("partial", False)
+        instance = await sync_to_async(self.get_object)()
+        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        new_name = serializer.validated_data.get("name")
+        if new_name and new_name != instance.name:
+            resume = (await sync_to_async(mark_branch_renames)([(instance, new_name)]))[instance.pk]
+            try:
+                instance.url = await get_async_github_service().rename_branch(
+                    instance.name, new_name, sha=instance.sha, resume=resume
+                )
+            except Exception:
+                await BranchesTask.objects.filter(pk=instance.pk).aupdate(renaming_to=None)
+                raise
+            instance.name = new_name
+            instance.state = BranchesTask.State.ACTIVE
+            instance.renaming_to = None
+            await instance.asave(update_fields=["name", "url", "state", "renaming_to"])
+        return Response(self.get_serializer(instance).data, status=status.HTTP_200_OK)
+
+    async def partial_update(self, request, *args, **kwargs):
+        kwargs["partial"] = True
+        return await self.update(request, *args, **kwargs)
+
+    async def destroy(self, request, *args, **kwargs):
+        instance = await sync_to_async(self.get_object)()
+        await get_async_github_service().delete_branch(instance.name)
+        await instance.adelete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 class UserTaskViewSet(viewsets.ModelViewSet):
     serializer_class = UserTaskSerializer
     base_permission_classes = [permissions.IsAuthenticated]
@@ -51,6 +177,9 @@ class UserTaskViewSet(viewsets.ModelViewSet):
         if getattr(self, 'swagger_fake_view', False):
             return UserTask.objects.none()
         return UserTask.objects.filter(task_id=self.kwargs['task_pk'])
+
+    def list(self, request, *args, **kwargs):
+        return cached_task_response(request, self.kwargs['task_pk'], super().list, *args, **kwargs)
     
     def get_permissions(self):
         permission_classes = self.base_permission_classes[:]
@@ -66,11 +195,24 @@ class UserTaskViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         if self.action == "log_time":
             return LogWorkTimeSerializer
+        if self.action == "bulk":
+            return UserTaskBulkCreateSerializer
         return UserTaskSerializer
     
     def perform_create(self, serializer):
         serializer.save(task_id=self.kwargs['task_pk'])
 
+    @action(detail=False, methods=["post"], name="Bulk add participants")
+    def bulk(self, request, task_pk=None):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+        added = any(result["status"] == "added" for result in results)
+        return Response(
+            {"results": results},
+            status=status.HTTP_201_CREATED if added else status.HTTP_400_BAD_REQUEST
+        )
+
     @action(detail=True, methods=["post"], name="Log work time")
     def log_time(self, request, task_pk=None, pk=None):
         user_task = self.get_object()
@@ -83,6 +225,32 @@ class UserTaskViewSet(viewsets.ModelViewSet):
             status=status.HTTP_200_OK
         )
     
+class AsyncUserTaskViewSet(AsyncGenericViewSet, UserTaskViewSet):
+    """
+    UserTaskViewSet whose participant-add actions create the new branches right away
+    on the event loop's GitHub pool, failures stay in the outbox. Enabled by GITHUB_ASYNC_VIEWS.
+    """
+
+    async def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        user_task = await sync_to_async(serializer.save)(task_id=self.kwargs['task_pk'])
+        branch = await BranchesTask.objects.aget(user_task=user_task)
+        await acreate_queued_branches([branch])
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=["post"], name="Bulk add participants")
+    async def bulk(self, request, task_pk=None):
+        serializer = self.get_serializer(data=request.data)
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        results, added = await sync_to_async(serializer.add_participants)(serializer.validated_data)
+        await acreate_queued_branches([branch for _, _, branch in added])
+        results = await sync_to_async(serializer.report)(results, added)
+        return Response(
+            {"results": results},
+            status=status.HTTP_201_CREATED if added else status.HTTP_400_BAD_REQUEST
+        )
+
 class ChangePasswordView(generics.GenericAPIView):
     serializer_class = ChangePasswordSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -98,3 +266,65 @@ class ChangePasswordView(generics.GenericAPIView):
         serializer.save()
         return Response({"status": "password set successfully"}, status=status.HTTP_200_OK)
 
+
+
+class WorkTimeReportView(generics.GenericAPIView):
+    """
+    Work time against planned time from the report materialized views.
+    Staff see every user, other users only their own rows.
+    """
+    serializer_class = WorkTimeReportQuerySerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        user = None if request.user.is_staff else request.user
+        rows = work_time_report(serializer.validated_data["group_by"], user=user)
+        return Response({"results": rows}, status=status.HTTP_200_OK)
+
+class RefreshWorkTimeReportView(generics.GenericAPIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        refresh_work_time_reports()
+        return Response({"status": "reports refreshed"}, status=status.HTTP_200_OK)
+
+
+class GitHubRateLimitView(generics.GenericAPIView):
+    """GitHub request budget of this worker process as last reported by GitHub"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(github_scheduler.stats())
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, guarded by METRICS_TOKEN and hidden when it is not set"""
+    if not settings.METRICS_TOKEN:
+        return HttpResponseNotFound()
+    if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@csrf_exempt
+@require_POST
+def github_webhook_view(request):
+    """
+    Receives create, delete and push events signed with GITHUB_WEBHOOK_SECRET.
+    Events are only stored here, process_webhook_events applies them.
+    """
+    if not settings.GITHUB_WEBHOOK_SECRET:
+        return HttpResponseNotFound()
+    if not verify_signature(request.body, request.headers.get("X-Hub-Signature-256")):
+        return HttpResponseForbidden()
+    delivery_id = request.headers.get("X-GitHub-Delivery")
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return HttpResponseBadRequest("Payload must be JSON")
+    if not delivery_id or not isinstance(payload, dict):
+        return HttpResponseBadRequest("Not a GitHub delivery")
+    store_event(delivery_id, request.headers.get("X-GitHub-Event", ""), payload)
+    return HttpResponse(status=202)
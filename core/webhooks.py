@@ -0,0 +1,111 @@
+"""
+GitHub webhook intake. Deliveries are verified, reduced to the branch they change and
+stored, process_events() applies them to BranchesTask in batches.
+"""
+import hashlib
+import hmac
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import BranchesTask, GitHubWebhookEvent
+from .services import GitHubService
+from .caching import bump_task_versions
+
+logger = logging.getLogger(__name__)
+
+
+def verify_signature(body, signature):
+    """Checks the X-Hub-Signature-256 header against GITHUB_WEBHOOK_SECRET"""
+    if not settings.GITHUB_WEBHOOK_SECRET or not signature:
+        return False
+    expected = hmac.new(settings.GITHUB_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(f"sha256={expected}", signature)
+
+
+def branch_change(event, payload):
+    """
+    (branch name, whether it exists afterwards, head SHA when the event tells it) for create,
+    delete and push events on branches of GITHUB_REPO_NAME, None for anything else.
+    """
+    if (payload.get("repository") or {}).get("full_name") != settings.GITHUB_REPO_NAME:
+        return None
+    if event in ("create", "delete"):
+        if payload.get("ref_type") != "branch" or not payload.get("ref"):
+            return None
+        return payload["ref"], event == "create", None
+    if event == "push":
+        ref = payload.get("ref") or ""
+        if not ref.startswith("refs/heads/"):
+            return None
+        deleted = payload.get("deleted", False)
+        return ref.removeprefix("refs/heads/"), not deleted, None if deleted else payload.get("after")
+    return None
+
+
+def store_event(delivery_id, event, payload):
+    """
+    Stores the branch change of a delivery for the worker.
+    Returns False for redeliveries and events that change no branch.
+    """
+    change = branch_change(event, payload)
+    if change is None:
+        return False
+    branch, exists, sha = change
+    _, created = GitHubWebhookEvent.objects.get_or_create(
+        delivery_id=delivery_id, defaults={"event": event, "branch": branch, "exists": exists, "sha": sha}
+    )
+    return created
+
+
+def process_events(batch_size=None):
+    """
+    Applies one batch of stored events. Events of the same branch are coalesced,
+    the last one received wins, and the affected rows are written in one bulk update.
+    Branches still waiting in the outbox are left to the outbox worker, deletes of
+    branches being renamed are left to the rename, which removes the old name itself.
+    Returns a (processed events, updated rows) tuple.
+    """
+    batch_size = batch_size or settings.GITHUB_WEBHOOK_BATCH_SIZE
+    with transaction.atomic():
+        events = list(
+            GitHubWebhookEvent.objects
+            .select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .order_by("id")[:batch_size]
+        )
+        if not events:
+            return 0, 0
+        exists = {}
+        shas = {}
+        for event in events:
+            exists[event.branch] = event.exists
+            if event.sha or not event.exists:
+                shas[event.branch] = event.sha
+
+        changed = []
+        for branch in BranchesTask.objects.filter(name__in=exists).exclude(state=BranchesTask.State.PENDING):
+            if exists[branch.name]:
+                state, url = BranchesTask.State.ACTIVE, GitHubService.branch_url(branch.name)
+            elif branch.renaming_to:
+                continue
+            else:
+                state, url = BranchesTask.State.DELETED, None
+            sha = shas.get(branch.name, branch.sha)
+            if (branch.state, branch.url, branch.sha) != (state, url, sha):
+                branch.state, branch.url, branch.sha = state, url, sha
+                changed.append(branch)
+        if changed:
+            BranchesTask.objects.bulk_update(changed, ["state", "url", "sha"])
+            bump_task_versions(*{branch.task_id for branch in changed})
+        GitHubWebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(processed_at=timezone.now())
+    logger.info("Webhook events processed: %s, branches updated: %s", len(events), len(changed))
+    return len(events), len(changed)
+
+
+def purge_processed_events():
+    """Deletes events processed more than GITHUB_WEBHOOK_RETENTION_DAYS ago"""
+    cutoff = timezone.now() - timedelta(days=settings.GITHUB_WEBHOOK_RETENTION_DAYS)
+    deleted, _ = GitHubWebhookEvent.objects.filter(processed_at__lt=cutoff).delete()
+    return deleted
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -113,6 +114,24 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -137,14 +156,50 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'core.User'
 
+# Build request.user from token claims and cache full users instead of loading them on every request
+JWT_STATELESS_AUTH = os.getenv('JWT_STATELESS_AUTH', 'False') == 'True'
+# Also how long access tokens outlive a password change or deactivation in other workers
+JWT_USER_CACHE_TTL = int(os.getenv('JWT_USER_CACHE_TTL', 60))
+JWT_USER_CACHE_SIZE = int(os.getenv('JWT_USER_CACHE_SIZE', 10000))
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.StatelessJWTAuthentication' if JWT_STATELESS_AUTH
+        else 'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.IdCursorPagination',
+    'PAGE_SIZE': int(os.getenv('API_PAGE_SIZE', 50)),
+}
+
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', 500))
+TASK_BULK_MAX_ITEMS = int(os.getenv('TASK_BULK_MAX_ITEMS', 500))
+PARTICIPANT_BULK_MAX_ITEMS = int(os.getenv('PARTICIPANT_BULK_MAX_ITEMS', 200))
+TASK_CACHE_TTL = int(os.getenv('TASK_CACHE_TTL', 300))
+# Task versions and payloads must be shared by all workers, so ETag caching needs Redis
+TASK_CACHE_ENABLED = bool(os.getenv('REDIS_URL'))
+# Versions outlive the payloads cached under them, an expired version only starts a new one
+TASK_VERSION_TTL = max(int(os.getenv('TASK_VERSION_TTL', 86400)), 2 * TASK_CACHE_TTL)
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 2000))
+STATUS_REGISTRY_TTL = int(os.getenv('STATUS_REGISTRY_TTL', 300))
+# Bearer token expected by /metrics, the endpoint answers 404 when it is empty
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '{asctime} {levelname} {name}: {message}', 'style': '{'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'core': {'handlers': ['console'], 'level': os.getenv('LOG_LEVEL', 'INFO')},
+    },
 }
 
 SWAGGER_SETTINGS = {
@@ -161,7 +216,57 @@ SWAGGER_SETTINGS = {
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=180),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
+    "TOKEN_USER_CLASS": "core.authentication.TrackerTokenUser",
+    "TOKEN_OBTAIN_SERIALIZER": "core.serializers.TokenObtainPairWithClaimsSerializer",
 }
+if JWT_STATELESS_AUTH:
+    # Stateless tokens carry a hash of the password and stop working once it changes
+    SIMPLE_JWT.update({
+        "CHECK_REVOKE_TOKEN": True,
+        "TOKEN_REFRESH_SERIALIZER": "core.serializers.RevocableTokenRefreshSerializer",
+    })
 
 GITHUB_ACCESS_TOKEN = os.getenv('GITHUB_ACCESS_TOKEN')
-GITHUB_REPO_NAME = os.getenv("GITHUB_REPO_NAME")
\ No newline at end of file
+GITHUB_REPO_NAME = os.getenv("GITHUB_REPO_NAME")
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+GITHUB_POOL_SIZE = int(os.getenv("GITHUB_POOL_SIZE", 10))
+GITHUB_SERVICE_REFRESH_INTERVAL = int(os.getenv("GITHUB_SERVICE_REFRESH_INTERVAL", 300))
+GITHUB_SHA_CACHE_TTL = int(os.getenv("GITHUB_SHA_CACHE_TTL", 30))
+GITHUB_MAX_CONCURRENCY = int(os.getenv("GITHUB_MAX_CONCURRENCY", 8))
+# Page size of GitHub listings, 100 is the maximum the API allows
+GITHUB_PER_PAGE = int(os.getenv("GITHUB_PER_PAGE", 100))
+# Rename branches with GitHub's rename endpoint, off for servers without it (copy and delete instead)
+GITHUB_NATIVE_RENAME = os.getenv("GITHUB_NATIVE_RENAME", "True") == "True"
+# PyGithub's own throttling serializes concurrent calls, GITHUB_MAX_CONCURRENCY bounds the load instead
+GITHUB_SECONDS_BETWEEN_REQUESTS = float(os.getenv("GITHUB_SECONDS_BETWEEN_REQUESTS", 0))
+GITHUB_SECONDS_BETWEEN_WRITES = float(os.getenv("GITHUB_SECONDS_BETWEEN_WRITES", 0))
+# Request budget shared by all GitHub calls of a process, see core.github_scheduler
+GITHUB_RATE_LIMIT_PER_SECOND = float(os.getenv("GITHUB_RATE_LIMIT_PER_SECOND", 10))
+GITHUB_RATE_LIMIT_BURST = int(os.getenv("GITHUB_RATE_LIMIT_BURST", 50))
+GITHUB_MAX_IN_FLIGHT = int(os.getenv("GITHUB_MAX_IN_FLIGHT", 20))
+# Quota kept back: below it requests wait for GitHub's reset
+GITHUB_RATE_LIMIT_RESERVE = int(os.getenv("GITHUB_RATE_LIMIT_RESERVE", 50))
+GITHUB_RATE_LIMIT_RETRIES = int(os.getenv("GITHUB_RATE_LIMIT_RETRIES", 4))
+GITHUB_RATE_LIMIT_BACKOFF = float(os.getenv("GITHUB_RATE_LIMIT_BACKOFF", 1))
+# Longer waits fail with 429 instead of holding the request
+GITHUB_RATE_LIMIT_MAX_WAIT = float(os.getenv("GITHUB_RATE_LIMIT_MAX_WAIT", 60))
+GITHUB_SERVER_ERROR_RETRIES = int(os.getenv("GITHUB_SERVER_ERROR_RETRIES", 3))
+# Serve branch and participant writes from async views, run the project under ASGI to benefit
+GITHUB_ASYNC_VIEWS = os.getenv("GITHUB_ASYNC_VIEWS", "False") == "True"
+GITHUB_ASYNC_MAX_CONNECTIONS = int(os.getenv("GITHUB_ASYNC_MAX_CONNECTIONS", 200))
+# Calls one event loop keeps in flight. Waiting coroutines hold no thread, so the cap is
+# far above GITHUB_MAX_IN_FLIGHT; the pace is still set by the shared request budget
+GITHUB_ASYNC_MAX_IN_FLIGHT = int(os.getenv("GITHUB_ASYNC_MAX_IN_FLIGHT", 200))
+GITHUB_ASYNC_TIMEOUT = float(os.getenv("GITHUB_ASYNC_TIMEOUT", 30))
+
+BRANCH_OUTBOX_BATCH_SIZE = int(os.getenv("BRANCH_OUTBOX_BATCH_SIZE", 20))
+BRANCH_OUTBOX_MAX_ATTEMPTS = int(os.getenv("BRANCH_OUTBOX_MAX_ATTEMPTS", 8))
+BRANCH_OUTBOX_BACKOFF = int(os.getenv("BRANCH_OUTBOX_BACKOFF", 5))
+BRANCH_OUTBOX_MAX_BACKOFF = int(os.getenv("BRANCH_OUTBOX_MAX_BACKOFF", 900))
+BRANCH_OUTBOX_LEASE = int(os.getenv("BRANCH_OUTBOX_LEASE", 120))
+
+# Secret of the GitHub webhook, the endpoint answers 404 while it is empty
+GITHUB_WEBHOOK_SECRET = os.getenv("GITHUB_WEBHOOK_SECRET", "")
+GITHUB_WEBHOOK_BATCH_SIZE = int(os.getenv("GITHUB_WEBHOOK_BATCH_SIZE", 500))
+# Processed events are kept this long to drop redeliveries
+GITHUB_WEBHOOK_RETENTION_DAYS = int(os.getenv("GITHUB_WEBHOOK_RETENTION_DAYS", 7))